@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser.gfm import GFMParser
+import argparse
+import gc
+import math
+import time
+
+# Pathological inputs by family, functions of the size n (characters and lines grow linearly in n)
+FAMILIES = {
+    "unclosed_backticks": lambda n: "`" * n,
+    "backtick_runs": lambda n: "".join("`" * i + " a " for i in range(1, int(math.sqrt(2 * n)))),
+    "unclosed_code_span": lambda n: "`a" + " b" * n,
+    "unclosed_autolinks": lambda n: "<a" * n,
+    "unclosed_autolink_text": lambda n: "<http://a" + " b" * n,
+    "many_autolinks": lambda n: "<http://a> " * (n // 10),
+    "open_emphasis": lambda n: "*a " * n,
+    "emphasis_runs": lambda n: "*" * n + "a" + "_" * n,
+    "alternating_emphasis": lambda n: "*a_" * n,
+    # 2n delimiters, 64k at the largest default size
+    "alternating_delimiters": lambda n: "*_" * n,
+    "nested_emphasis": lambda n: "*" * (n // 2) + "a" + "*" * (n // 2),
+    "nested_emphasis_words": lambda n: "*a " * (n // 6) + "b" + " a*" * (n // 6),
+    "open_brackets": lambda n: "[" * n + "a",
+    "block_quote_line": lambda n: ">" * n + " a",
+    "block_quote_lines": lambda n: "\n".join(">" * min(i, 50) + " a" for i in range(n // 20)),
+    "nested_block_quotes": lambda n: "\n".join("> " * i + "a" for i in range(int(math.sqrt(n)))),
+    "nested_lists": lambda n: "\n".join("  " * i + "- a" for i in range(int(math.sqrt(n)))),
+    "nested_ordered_lists": lambda n: "\n".join("   " * i + "1. a" for i in range(int(math.sqrt(n)))),
+    "long_list": lambda n: "\n".join("- a" for _ in range(n // 4)),
+    "loose_list": lambda n: "\n\n".join("- a" for _ in range(n // 5)),
+    "list_item_paragraphs": lambda n: "- a\n" + "\n".join("  b\n" for _ in range(n // 5)),
+    "outline": lambda n: "\n".join("  " * (i % 8) + "- a" for i in range(n // 10)),
+    "loose_outline": lambda n: "\n\n".join("  " * (i % 8) + "- a" for i in range(n // 11)),
+    "tabs_line": lambda n: "\t" * n + "a",
+    "tab_text_line": lambda n: "a\t" * n,
+    "tabbed_block_quotes": lambda n: ">\t" * n + "a",
+    "tab_lines": lambda n: "\n".join("\t\ta\tb\t" for _ in range(n // 7)),
+    "paragraphs": lambda n: "a\n\n" * (n // 3),
+    "paragraph_lines": lambda n: "a\n" * (n // 2),
+    "atx_heading_spaces": lambda n: "# a" + " \t" * (n // 2) + "b",
+    "setext_headings": lambda n: "a\n-\n" * (n // 4),
+    "fences": lambda n: "```\n" * (n // 4),
+    "fence_info_spaces": lambda n: "``` a" + " " * n + "b",
+    "fence_info_backtick": lambda n: "~" * n + "`",
+    "fenced_lines": lambda n: "````\n" + "```\n" * (n // 4),
+    "indented_code": lambda n: "    a\n\n" * (n // 7),
+    "hard_breaks": lambda n: "a  \n" * (n // 4),
+    "inner_spaces": lambda n: "a" + " " * n + "b",
+    "escapes": lambda n: "\\*" * (n // 2),
+    "entities": lambda n: "&amp;" * (n // 5),
+}
+
+# One of each top-level block, repeated for documents with many blocks
+TOP_LEVEL_BLOCKS = ("# a\n", "a\nb\n\n", "- a\n\n", "> a\n\n", "```\na\n```\n", "    a\n\n", "***\n")
+# Levels of the nested outlines of outline_sweep
+OUTLINE_DEPTH = 40
+
+
+def measure(text, repeat):
+    """
+    Return the least CPU seconds of converting text in repeat runs. CPU time of this process only, so other
+    processes on the machine don't make the larger (longer running) sizes look slower.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.process_time()
+        GFMParser().parse_text(text).get_html()
+        best = min(best, time.process_time() - start)
+    return best
+
+
+def exponent(points):
+    """Least squares fit of the exponent k of time = c * size^k"""
+    xs = [math.log(size) for size, seconds in points]
+    ys = [math.log(seconds) for size, seconds in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+
+def steepest_step(points):
+    """Return the exponent between the two consecutive points where the time grows fastest and the larger size"""
+    return max((math.log(seconds / last_seconds) / math.log(size / last_size), size)
+               for (last_size, last_seconds), (size, seconds) in zip(points, points[1:]))
+
+
+def sweep(family, start, steps, repeat):
+    """Return (size, seconds) of the family for sizes doubling from start"""
+    points = []
+    for step in range(steps):
+        text = FAMILIES[family](start << step)
+        points.append((len(text), measure(text, repeat)))
+    return points
+
+
+def block_sweep(blocks, repeat):
+    """Return (lines, seconds) of documents with blocks / 100, blocks / 10 and blocks top-level blocks"""
+    points = []
+    for count in (blocks // 100, blocks // 10, blocks):
+        text = "".join(TOP_LEVEL_BLOCKS) * (count // len(TOP_LEVEL_BLOCKS))
+        points.append((text.count("\n"), measure(text, repeat)))
+    return points
+
+
+def outline_sweep(items, loose, repeat):
+    """Return (items, seconds) of outlines OUTLINE_DEPTH levels deep with items / 20, items / 2 and items items"""
+    points = []
+    for count in (items // 20, items // 2, items):
+        text = ("\n\n" if loose else "\n").join("  " * (i % OUTLINE_DEPTH) + "- a" for i in range(count))
+        points.append((count, measure(text, repeat)))
+    return points
+
+
+def check(points_of, repeat, max_exponent):
+    """
+    Return the fitted exponent and the (size, seconds) points_of(repeat). If the exponent is too high, the
+    points are measured again with three times the repeats and the best times of both count, so a single
+    slow run doesn't fail the check.
+    """
+    points = points_of(repeat)
+    k = exponent(points)
+    if k > max_exponent:
+        again = points_of(3 * repeat)
+        points = [(size, min(seconds, more[1])) for (size, seconds), more in zip(points, again)]
+        k = exponent(points)
+    return k, points
+
+
+def verdict(k, points, max_exponent, unit):
+    """Return the FAIL note with the step that grows fastest, empty if k is fine"""
+    if k <= max_exponent:
+        return ""
+    step, size = steepest_step(points)
+    return "  FAIL, steepest step n^{:.2f} up to {} {}".format(step, size, unit)
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Check that pathological inputs take linear time")
+    argp.add_argument('family', nargs='*', help="Families to check (default: all): " + ", ".join(FAMILIES))
+    argp.add_argument('--start', type=int, default=2000, help="Smallest size")
+    argp.add_argument('--steps', type=int, default=6, help="Number of sizes, each doubles the previous")
+    argp.add_argument('--repeat', type=int, default=5, help="Runs per size, the best one counts")
+    argp.add_argument('--max-exponent', type=float, default=1.3,
+                      help="Fitted growth exponent above which a family fails")
+    argp.add_argument('--blocks', type=int, default=100000,
+                      help="Also check that the time per line stays flat up to this many top-level blocks "
+                           "when no family is given, 0 skips it")
+    argp.add_argument('--items', type=int, default=20000,
+                      help="Also check that the time per item stays flat up to this many items of nested tight "
+                           "and loose outlines when no family is given, 0 skips it")
+    args = argp.parse_args()
+    for family in args.family:
+        if family not in FAMILIES:
+            argp.error("unknown family " + family)
+
+    failed = []
+    for family in args.family or FAMILIES:
+        try:
+            k, points = check(lambda repeat: sweep(family, args.start, args.steps, repeat), args.repeat,
+                              args.max_exponent)
+        except Exception as e:
+            print("{:24} error: {}: {}".format(family, type(e).__name__, e))
+            failed.append(family)
+            continue
+        if k > args.max_exponent:
+            failed.append(family)
+        print("{:24} n^{:.2f} {:9.4f} s at {:8} characters{}".format(
+            family, k, points[-1][1], points[-1][0], verdict(k, points, args.max_exponent, "characters")))
+    # Checks at fixed counts: (name, function of the repeats returning (count, seconds), unit of the count)
+    counted = []
+    if args.blocks and not args.family:
+        counted.append(("top_level_blocks", lambda repeat: block_sweep(args.blocks, repeat), "lines"))
+    if args.items and not args.family:
+        counted.append(("outline_items", lambda repeat: outline_sweep(args.items, False, repeat), "items"))
+        counted.append(("loose_outline_items", lambda repeat: outline_sweep(args.items, True, repeat), "items"))
+    for name, points_of, unit in counted:
+        k, points = check(points_of, args.repeat, args.max_exponent)
+        if k > args.max_exponent:
+            failed.append(name)
+        (small_count, small_seconds), (count, seconds) = points[0], points[-1]
+        print("{:24} n^{:.2f} {:.1f} us each at {} {}, {:.1f} us at {} {}{}".format(
+            name, k, small_seconds / small_count * 1e6, small_count, unit, seconds / count * 1e6, count, unit,
+            verdict(k, points, args.max_exponent, unit)))
+    if failed:
+        print("Worse than linear: " + ", ".join(failed))
+        sys.exit(1)
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+
+WORDS = ("the", "of", "markdown", "parser", "block", "inline", "a", "to", "in", "is", "list", "with",
+         "HTML", "document", "line", "text", "for", "code", "that", "on", "quote", "heading", "it",
+         "emphasis", "link", "as", "are", "by", "this", "be", "from", "or", "an", "which", "not")
+LANGUAGES = ("python", "c", "js", "", "sh")
+
+
+def words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def prose(rng, size):
+    """Long paragraphs of wrapped text with a few headings"""
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.1:
+            parts.append("#" * rng.randint(1, 3) + " " + words(rng, rng.randint(2, 6)) + "\n\n")
+        lines = [words(rng, rng.randint(8, 14)) for _ in range(rng.randint(5, 30))]
+        parts.append("\n".join(lines) + "\n\n")
+        length += len(parts[-1])
+    return "".join(parts)
+
+
+def nested_lists(rng, size):
+    """Bullet and ordered lists nested up to eight levels"""
+    parts = []
+    length = 0
+    # Column of the items of each level
+    columns = [0]
+    while length < size:
+        depth = max(0, min(len(columns) - 1, 7, len(columns) - 1 + rng.choice((-2, -1, 0, 0, 1))))
+        marker = rng.choice(("-", "*", "+", "1.", "2)"))
+        del columns[depth + 1:]
+        columns.append(columns[depth] + len(marker) + 1)
+        parts.append(" " * columns[depth] + marker + " " + words(rng, rng.randint(2, 10)) + "\n")
+        if rng.random() < 0.05:
+            parts.append("\n")
+            del columns[1:]
+        length += len(parts[-1])
+    return "".join(parts)
+
+
+def fenced_code(rng, size):
+    """Many fenced code blocks between short paragraphs"""
+    parts = []
+    length = 0
+    while length < size:
+        parts.append(words(rng, rng.randint(5, 20)) + "\n\n")
+        fence = rng.choice(("```", "~~~", "````"))
+        code = "\n".join("    " * rng.randint(0, 3) + words(rng, rng.randint(1, 8))
+                         for _ in range(rng.randint(5, 60)))
+        parts.append(fence + rng.choice(LANGUAGES) + "\n" + code + "\n" + fence + "\n\n")
+        length += len(parts[-2]) + len(parts[-1])
+    return "".join(parts)
+
+
+def emphasis(rng, size):
+    """Paragraphs dense with emphasis, strong emphasis, code spans, links and autolinks"""
+    def token():
+        word = rng.choice(WORDS)
+        return rng.choice((word, word, "*" + word + "*", "_" + word + "_", "**" + word + "**",
+                           "__" + word + "__", "*" + word, word + "_", "[" + word + "]",
+                           "<http://example.com/" + word + ">", "\\*" + word))
+    parts = []
+    length = 0
+    while length < size:
+        lines = [("`" + words(rng, 2) + "` " if rng.random() < 0.2 else "") +
+                 " ".join(token() for _ in range(rng.randint(6, 14))) for _ in range(rng.randint(2, 10))]
+        parts.append("\n".join(lines) + "\n\n")
+        length += len(parts[-1])
+    return "".join(parts)
+
+
+def mixed(rng, size):
+    """A mix of all kinds of blocks like a typical README"""
+    parts = []
+    length = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.15:
+            part = "#" * rng.randint(1, 4) + " " + words(rng, rng.randint(2, 6)) + "\n\n"
+        elif kind < 0.3:
+            part = nested_lists(rng, rng.randint(50, 400)) + "\n"
+        elif kind < 0.4:
+            part = fenced_code(rng, rng.randint(50, 300))
+        elif kind < 0.5:
+            part = "".join("> " + words(rng, rng.randint(4, 12)) + "\n" for _ in range(rng.randint(1, 5))) + "\n"
+        elif kind < 0.55:
+            part = "***\n\n"
+        else:
+            part = emphasis(rng, rng.randint(50, 400)) if rng.random() < 0.3 else prose(rng, rng.randint(50, 400))
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def small_files(rng, size):
+    """Many short documents, returned as a list"""
+    documents = []
+    length = 0
+    while length < size:
+        documents.append(mixed(rng, rng.randint(100, 1500)))
+        length += len(documents[-1])
+    return documents
+
+
+# Generators by corpus name, they take a random.Random and the approximate size in characters
+CORPORA = {
+    "prose": prose,
+    "nested_lists": nested_lists,
+    "fenced_code": fenced_code,
+    "emphasis": emphasis,
+    "mixed": mixed,
+    "small_files": small_files,
+}
+
+
+def generate(name, seed, size):
+    """Return the documents of a corpus, the same for the same seed and size"""
+    documents = CORPORA[name](random.Random("{}-{}".format(name, seed)), size)
+    return documents if type(documents) is list else [documents]
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser.gfm import GFMParser
+from parser.inlines import InlineParser
+import corpus
+import argparse
+import gc
+import tracemalloc
+
+
+class InlineTexts(object):
+    """Record the texts the blocks give to InlineParser.parse while rendering"""
+    def __enter__(self):
+        self.parse = InlineParser.__dict__["parse"]
+        self.texts = []
+        InlineParser.parse = staticmethod(lambda text: self.texts.append(text) or "")
+        return self
+
+    def __exit__(self, *args):
+        InlineParser.parse = self.parse
+
+
+def allocated(function):
+    """Return the result of function and the bytes it allocated that are still in use"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def measure(documents):
+    """Return the bytes of the block trees and of the inline trees of documents"""
+    lines = [list(GFMParser.text_lines(document)) for document in documents]
+
+    def parse():
+        parsers = []
+        for document_lines in lines:
+            parser = GFMParser()
+            for line in document_lines:
+                parser.parse_line(line)
+            parsers.append(parser)
+        return parsers
+    parsers, block_bytes = allocated(parse)
+    with InlineTexts() as recorder:
+        for parser in parsers:
+            parser.get_html()
+    inlines, inline_bytes = allocated(lambda: [InlineParser.get_inlines(text) for text in recorder.texts])
+    return block_bytes, inline_bytes
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Measure the memory of block and inline trees per source byte")
+    argp.add_argument('corpus', nargs='*', help="Corpora to measure (default: all): " + ", ".join(sorted(corpus.CORPORA)))
+    argp.add_argument('--seed', type=int, default=1, help="Seed of the corpus generators")
+    argp.add_argument('--size', type=int, default=200000, help="Approximate characters per corpus")
+    args = argp.parse_args()
+    for name in args.corpus:
+        if name not in corpus.CORPORA:
+            argp.error("unknown corpus " + name)
+
+    print("{:14} {:>12} {:>12} {:>12}".format("corpus", "blocks B/B", "inlines B/B", "total B/B"))
+    for name in args.corpus or sorted(corpus.CORPORA):
+        documents = corpus.generate(name, args.seed, args.size)
+        size = sum(len(document.encode()) for document in documents)
+        block_bytes, inline_bytes = measure(documents)
+        print("{:14} {:12.2f} {:12.2f} {:12.2f}".format(
+            name, block_bytes / size, inline_bytes / size, (block_bytes + inline_bytes) / size))
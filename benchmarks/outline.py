@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser.gfm import GFMParser
+import corpus
+import argparse
+import time
+
+
+def measure(documents, repeat):
+    """Return the best seconds of parsing and rendering documents and of parsing them and getting the outlines"""
+    lines = [list(GFMParser.text_lines(document)) for document in documents]
+    methods = (GFMParser.get_html, GFMParser.outline)
+    results = [float("inf")] * len(methods)
+    # The modes take turns, so a slower phase of the machine doesn't only hit one of them
+    for _ in range(repeat):
+        for i, method in enumerate(methods):
+            start = time.perf_counter()
+            for document_lines in lines:
+                parser = GFMParser()
+                for line in document_lines:
+                    parser.parse_line(line)
+                method(parser)
+            results[i] = min(results[i], time.perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Compare the outline mode with converting the whole document")
+    argp.add_argument('corpus', nargs='*', help="Corpora to measure (default: all): " + ", ".join(sorted(corpus.CORPORA)))
+    argp.add_argument('--seed', type=int, default=1, help="Seed of the corpus generators")
+    argp.add_argument('--size', type=int, default=1000000, help="Approximate characters per corpus")
+    argp.add_argument('--repeat', type=int, default=3, help="Runs of each mode, the best one counts")
+    args = argp.parse_args()
+    for name in args.corpus:
+        if name not in corpus.CORPORA:
+            argp.error("unknown corpus " + name)
+
+    print("{:14} {:>13} {:>13} {:>8}".format("corpus", "get_html MB/s", "outline MB/s", "speedup"))
+    for name in args.corpus or sorted(corpus.CORPORA):
+        documents = corpus.generate(name, args.seed, args.size)
+        size = sum(len(document.encode()) for document in documents) / 1e6
+        html_seconds, outline_seconds = measure(documents, args.repeat)
+        print("{:14} {:13.2f} {:13.2f} {:7.1f}x".format(name, size / html_seconds, size / outline_seconds,
+                                                        html_seconds / outline_seconds))
@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser.gfm import GFMParser
+from parser.parallel import ParallelParser
+import corpus
+import argparse
+import json
+import time
+
+
+def compare(text, parser):
+    """Return the seconds of the serial and the parallel conversion of text and whether the HTML is the same"""
+    start = time.perf_counter()
+    html = GFMParser().parse_text(text).get_html()
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    same = parser.get_html(text) == html
+    return serial, time.perf_counter() - start, same
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Compare ParallelParser with the serial parser")
+    argp.add_argument('corpus', nargs='*', help="Corpora to convert (default: all): " + ", ".join(sorted(corpus.CORPORA)))
+    argp.add_argument('--seed', type=int, default=1, help="Seed of the corpus generators")
+    argp.add_argument('--size', type=int, default=4000000, help="Approximate characters per corpus")
+    argp.add_argument('-j', '--jobs', type=int, help="Worker processes (default: CPUs)")
+    argp.add_argument('--chunk-size', type=int, default=ParallelParser.CHUNK_SIZE, help="Characters per chunk")
+    argp.add_argument('--spec', help="Also check the CommonMark examples of a JSON file (spec_tests.py --dump-tests)")
+    args = argp.parse_args()
+    for name in args.corpus:
+        if name not in corpus.CORPORA:
+            argp.error("unknown corpus " + name)
+
+    parser = ParallelParser(args.jobs, args.chunk_size)
+    failed = 0
+    print("{:14} {:>7} {:>7} {:>11} {:>11} {:>8}".format("corpus", "chunks", "local", "serial MB/s",
+                                                         "par. MB/s", "same"))
+    for name in args.corpus or sorted(corpus.CORPORA):
+        text = "".join(corpus.generate(name, args.seed, args.size))
+        serial, parallel, same = compare(text, parser)
+        failed += not same
+        size = len(text.encode()) / 1e6
+        print("{:14} {:7} {:7} {:11.2f} {:11.2f} {:>8}".format(
+            name, parser.chunks, parser.serial_chunks, size / serial, size / parallel, "yes" if same else "NO"))
+    if args.spec:
+        with open(args.spec) as f:
+            examples = [example["markdown"] for example in json.load(f)]
+        # Tiny chunks, so the examples are split wherever possible
+        parser = ParallelParser(args.jobs, 1)
+        different = sum(not compare(text, parser)[2] for text in examples)
+        different += not compare("\n".join(examples), parser)[2]
+        print("CommonMark examples: {} of {} different".format(different, len(examples) + 1))
+        failed += different
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser.gfm import GFMParser
+from parser.inlines import InlineParser
+import corpus
+import argparse
+import json
+import platform
+import time
+
+RESULTS_VERSION = 1
+PHASES = ("block", "inline", "render")
+
+
+class InlineInputs(object):
+    """Replace InlineParser.parse while rendering: record its inputs, or answer from a dict"""
+    def __init__(self, results=None):
+        self.results = results
+        self.inputs = []
+
+    def __enter__(self):
+        self.parse = InlineParser.__dict__["parse"]
+        if self.results is None:
+            InlineParser.parse = staticmethod(lambda text: self.inputs.append(text) or "")
+        else:
+            InlineParser.parse = staticmethod(self.results.__getitem__)
+        return self
+
+    def __exit__(self, *args):
+        InlineParser.parse = self.parse
+
+
+def measure(documents, repeat):
+    """
+    Return the best seconds of each phase over repeat runs: the block phase parses the lines,
+    the inline phase parses the texts of the leaf blocks and the render phase builds the HTML
+    with the inline results already known
+    """
+    lines = [list(GFMParser.text_lines(document)) for document in documents]
+    times = {phase: float("inf") for phase in PHASES}
+    for _ in range(repeat):
+        parsers = [GFMParser() for _ in documents]
+        start = time.perf_counter()
+        for parser, document_lines in zip(parsers, lines):
+            for line in document_lines:
+                parser.parse_line(line)
+        times["block"] = min(times["block"], time.perf_counter() - start)
+
+    with InlineInputs() as recorder:
+        for parser in parsers:
+            parser.get_html()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = {text: InlineParser.parse(text) for text in recorder.inputs}
+        times["inline"] = min(times["inline"], time.perf_counter() - start)
+
+    for _ in range(repeat):
+        with InlineInputs(results):
+            start = time.perf_counter()
+            for parser in parsers:
+                parser.get_html()
+            times["render"] = min(times["render"], time.perf_counter() - start)
+    return times
+
+
+def run(names, seed, size, repeat):
+    results = {}
+    for name in names:
+        documents = corpus.generate(name, seed, size)
+        size_bytes = sum(len(document.encode()) for document in documents)
+        line_count = sum(document.count("\n") + 1 for document in documents)
+        results[name] = {"bytes": size_bytes, "lines": line_count, "documents": len(documents)}
+        for phase, seconds in measure(documents, repeat).items():
+            results[name][phase] = {"seconds": seconds, "mb_per_s": size_bytes / seconds / 1e6,
+                                    "lines_per_s": line_count / seconds}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every phase against the baseline, return the regressions"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for phase in PHASES:
+            old = baseline[name][phase]["mb_per_s"]
+            new = result[phase]["mb_per_s"]
+            change = new / old - 1
+            regressed = change < -threshold
+            print("{:14} {:7} {:8.3f} -> {:8.3f} MB/s {:+7.1%}{}".format(
+                name, phase, old, new, change, "  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append((name, phase))
+    return regressions
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Measure the throughput of the parser phases on generated corpora")
+    argp.add_argument('corpus', nargs='*',
+                      help="Corpora to measure (default: all): " + ", ".join(sorted(corpus.CORPORA)))
+    argp.add_argument('--seed', type=int, default=1, help="Seed of the corpus generators")
+    argp.add_argument('--size', type=int, default=200000, help="Approximate characters per corpus")
+    argp.add_argument('--repeat', type=int, default=3, help="Runs per phase, the best one counts")
+    argp.add_argument('-o', '--output', help="Write the results to this JSON file")
+    argp.add_argument('--baseline', help="Compare against the results in this JSON file")
+    argp.add_argument('--threshold', type=float, default=0.1,
+                      help="Relative slowdown against the baseline that counts as regression")
+    args = argp.parse_args()
+    for name in args.corpus:
+        if name not in corpus.CORPORA:
+            argp.error("unknown corpus " + name)
+
+    results = run(args.corpus or sorted(corpus.CORPORA), args.seed, args.size, args.repeat)
+    for name, result in sorted(results.items()):
+        for phase in PHASES:
+            print("{:14} {:7} {:8.3f} MB/s {:10.0f} lines/s".format(
+                name, phase, result[phase]["mb_per_s"], result[phase]["lines_per_s"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"version": RESULTS_VERSION, "python": platform.python_version(), "seed": args.seed,
+                       "size": args.size, "results": results}, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline["seed"], baseline["size"]) != (args.seed, args.size):
+            print("Warning: the baseline was measured on other corpora", file=sys.stderr)
+        if compare(results, baseline["results"], args.threshold):
+            sys.exit(1)
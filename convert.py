@@ -18,14 +18,185 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from parser.gfm import GFMParser
+from parser.parallel import ParallelParser
+from parser.serialize import ParseCache, parser_version
 import argparse
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# Buffer size of the output file
+OUTPUT_BUFFER = 1 << 20
+# Name of the manifest in the output directory of a batch conversion
+MANIFEST = ".convert-manifest.json"
+MANIFEST_VERSION = 1
+# Number of files handed to a worker at once
+CHUNK_SIZE = 8
+
+
+def find_sources(patterns):
+    """Return the Markdown files of files, directories (recursively) and glob patterns"""
+    sources = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if os.path.isdir(path):
+                for directory, dirs, files in os.walk(path):
+                    dirs.sort()
+                    sources.extend(os.path.join(directory, f) for f in sorted(files) if f.endswith(".md"))
+            else:
+                sources.append(path)
+    # Remove duplicates, keep order
+    return list(dict.fromkeys(os.path.normpath(s) for s in sources))
+
+
+def output_settings(text, skip_code):
+    """Return what the outputs depend on besides the sources: the output mode and the parser version"""
+    # skip_code only changes plain text
+    return {"text": text, "skip_code": text and skip_code, "parser": parser_version()}
+
+
+def load_manifest(path, settings):
+    """
+    Return the content hashes of the last run by relative source path, none if it wrote its outputs
+    with other settings
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != settings:
+        return {}
+    return manifest["files"]
+
+
+def save_manifest(path, files, settings):
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "settings": settings, "files": files}, f, indent=0,
+                  sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def convert_file(task):
+    """
+    Convert a source file to target, unless the hash of its content is old_hash and target exists.
+    With a parse_cache directory the parsed tree is taken from or stored there. With text the plain text
+    is written instead of HTML, without code blocks with skip_code.
+    Return (source, hash, seconds, size, error), seconds is None if the file was skipped.
+    """
+    source, target, old_hash, parse_cache, text, skip_code = task
+    start = time.perf_counter()
+    try:
+        with open(source, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest == old_hash and os.path.exists(target):
+            return source, digest, None, len(data), None
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        # Decode with universal newlines like a file opened in text mode
+        lines = GFMParser.split_lines(io.TextIOWrapper(io.BytesIO(data)))
+        with open(target, "w", buffering=OUTPUT_BUFFER) as out:
+            write_output(lines, out, parse_cache, text, skip_code)
+    except Exception as e:
+        return source, None, time.perf_counter() - start, 0, "{}: {}".format(type(e).__name__, e)
+    return source, digest, time.perf_counter() - start, len(data), None
+
+
+def write_output(lines, out, parse_cache=None, text=False, skip_code=False):
+    """Write the HTML (or the plain text) of lines to the file out"""
+    if parse_cache:
+        document = ParseCache(parse_cache).parse("".join(lines))
+        out.write(document.get_text(skip_code) if text else document.get_html() + "\n")
+    elif text:
+        GFMParser().write_text(lines, out, skip_code)
+    else:
+        GFMParser().write_html(lines, out)
+        out.write("\n")
+
+
+def convert_batch(patterns, out_dir, root=".", jobs=None, force=False, parse_cache=None, text=False,
+                  skip_code=False):
+    """
+    Convert the Markdown files in patterns to .html files (.txt with text) in out_dir, at their path
+    relative to root. Files whose content didn't change since the last run with the same output mode and
+    parser are skipped. Return the number of failures.
+    """
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    settings = output_settings(text, skip_code)
+    manifest = {} if force else load_manifest(manifest_path, settings)
+    tasks = []
+    for source in find_sources(patterns):
+        relative = os.path.relpath(source, root)
+        if relative.startswith(os.pardir):
+            print("{} is outside of {}, skipped".format(source, root), file=sys.stderr)
+            continue
+        target = os.path.join(out_dir, os.path.splitext(relative)[0] + (".txt" if text else ".html"))
+        tasks.append((source, target, manifest.get(relative), parse_cache, text, skip_code))
+
+    os.makedirs(out_dir, exist_ok=True)
+    converted = skipped = failed = total_size = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(jobs) as pool:
+        for source, digest, seconds, size, error in pool.imap_unordered(convert_file, tasks, CHUNK_SIZE):
+            relative = os.path.relpath(source, root)
+            if error is not None:
+                failed += 1
+                manifest.pop(relative, None)
+                print("{}: failed, {}".format(source, error), file=sys.stderr)
+                continue
+            manifest[relative] = digest
+            if seconds is None:
+                skipped += 1
+            else:
+                converted += 1
+                total_size += size
+                print("{}: {:.1f} ms".format(source, seconds * 1000))
+    elapsed = time.perf_counter() - start
+    save_manifest(manifest_path, manifest, settings)
+    print("{} converted, {} unchanged, {} failed in {:.2f} s ({:.1f} files/s, {:.2f} MB/s)".format(
+        converted, skipped, failed, elapsed, converted / elapsed if elapsed else 0,
+        total_size / elapsed / 1e6 if elapsed else 0))
+    return failed
+
 
 if __name__ == '__main__':
     argp = argparse.ArgumentParser(description="Convert Markdown to HTML")
-    argp.add_argument('file', help="Input markdown file")
+    argp.add_argument('file', nargs='+',
+                      help="Input markdown file, with --out-dir also directories and glob patterns")
+    argp.add_argument('-o', '--output', help="Output HTML file (default: standard output)")
+    argp.add_argument('--mmap', action='store_true', help="Memory-map the input file, for huge files")
+    argp.add_argument('-d', '--out-dir',
+                      help="Batch mode: write an .html file for every input to this directory")
+    argp.add_argument('--root', default=".",
+                      help="Batch mode: directory the output paths are relative to (default: current)")
+    argp.add_argument('-j', '--jobs', type=int,
+                      help="Number of worker processes (batch mode default: CPUs), a single file is split into chunks")
+    argp.add_argument('-f', '--force', action='store_true',
+                      help="Batch mode: convert unchanged files again")
+    argp.add_argument('--text', action='store_true', help="Write plain text instead of HTML, e.g. for a search index")
+    argp.add_argument('--skip-code', action='store_true', help="Leave code blocks out of the plain text")
+    argp.add_argument('--parse-cache',
+                      help="Keep the parsed documents in this directory, unchanged inputs aren't parsed again")
 
     args = argp.parse_args()
-    with open(args.file) as f:
-        parser = GFMParser()
-        parser.parse_text(f.read())
-        print(parser.get_html())
+    if args.out_dir:
+        sys.exit(1 if convert_batch(args.file, args.out_dir, args.root, args.jobs, args.force,
+                                    args.parse_cache, args.text, args.skip_code) else 0)
+    if len(args.file) > 1:
+        argp.error("multiple inputs require --out-dir")
+    out = open(args.output, "w", buffering=OUTPUT_BUFFER) if args.output else sys.stdout
+    try:
+        # Read the file line by line and write finished blocks while parsing
+        lines = GFMParser.split_lines(GFMParser.read_lines(args.file[0], use_mmap=args.mmap))
+        if args.jobs and args.jobs > 1 and not (args.parse_cache or args.text):
+            out.write(ParallelParser(args.jobs).get_html("".join(lines)) + "\n")
+        else:
+            write_output(lines, out, args.parse_cache, args.text, args.skip_code)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -18,21 +18,33 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import re
+import bisect
+import functools
 from .inlines import InlineParser
 import html
 
 
 class Block(object):
     """Interface for all Markdown blocks"""
+    __slots__ = ("closed", "close_next", "lines", "end_regex", "depth", "start_line", "end_line")
     _TEMPLATE = ""
     _END_REGEX = ""
     START_REGEX = re.compile("")
+    # First tag of the HTML of a block, data-sourcepos is inserted after its name
+    TAG_REGEX = re.compile(r"<[a-z][a-z0-9]*")
+    # Only container blocks have a list of children
+    children = ()
 
     def __init__(self):
         self.closed = False
         self.close_next = False
         self.lines = []
-        self.children = []
+        self.end_regex = None
+        # Position on the spine of the document
+        self.depth = 0
+        # Source lines (counted from 0) the block starts at and of its last non-blank line
+        self.start_line = None
+        self.end_line = None
 
     @classmethod
     def starts(cls, last_open, line, line_number, last):
@@ -40,45 +52,172 @@ class Block(object):
         return cls.START_REGEX.match(line) is not None
 
     @classmethod
-    def create(cls, line, line_number, stripped):
+    def create(cls, line, line_number, stripped, untabbed):
+        """
+        Create the block starting with line, which is the remainder of the UntabbedLine untabbed after
+        the column stripped
+        """
         return cls()
 
     def get_html(self):
         """Return HTML representation as text"""
-        return self._TEMPLATE.format(**self.__dict__)
+        return self._TEMPLATE.format(**self.fields())
+
+    def fields(self):
+        """Return the values of the template besides the content"""
+        return {}
+
+    def walk(self):
+        """Iterate over this block and its descendants in document order"""
+        stack = [self]
+        while stack:
+            block = stack.pop()
+            yield block
+            stack.extend(reversed(block.children))
+
+    def sourcepos_html(self, html):
+        """Insert a data-sourcepos attribute with the lines of this block (counted from 1) into the first tag"""
+        m = Block.TAG_REGEX.match(html)
+        if m is None:
+            return html
+        return '{} data-sourcepos="{}-{}"{}'.format(html[:m.end()], self.start_line + 1, self.end_line + 1,
+                                                    html[m.end():])
+
+    def write_html(self, out, loose=None, sourcepos=False):
+        """
+        Append the HTML of this block and its children to the list out, loose is the looseness of the
+        list for a list item. With sourcepos the tags of the blocks get data-sourcepos attributes.
+        The tree is walked with a stack instead of recursion and every fragment is written once, a
+        container only strips the ends of its content in out.
+        """
+        # Open containers as (iterator over the remaining children, loose value of the children,
+        # position of the content in out, HTML after the content, characters stripped from the content).
+        # loose is the looseness of the list for list items and their children and None otherwise.
+        stack = [(iter((self,)), loose, 0, "", "")]
+        while stack:
+            children, loose, position, end, strip = stack[-1]
+            for block in children:
+                if not isinstance(block, ContainerBlock):
+                    if loose is False and type(block) is Paragraph:
+                        # Tight list, don't wrap text into <p>-tags
+                        out.append("".join(block.lines).strip())
+                    elif sourcepos:
+                        out.append(block.sourcepos_html(block.get_html()))
+                    else:
+                        out.append(block.get_html())
+                    continue
+                start, block_end, block_strip, block_loose = block.html_frame(loose)
+                if start:
+                    out.append(block.sourcepos_html(start) if sourcepos else start)
+                stack.append((iter(block.children), block_loose, len(out), block_end, block_strip))
+                break
+            else:
+                stack.pop()
+                if strip != "":
+                    Block.strip_output(out, position, strip)
+                if end:
+                    out.append(end)
+
+    def get_text(self, skip_code=False):
+        """Return the plain text of this block and its children, without code blocks with skip_code"""
+        out = []
+        self.write_text(out, None, skip_code)
+        return "".join(out)
+
+    def write_text(self, out, loose=None, skip_code=False):
+        """
+        Append the plain text of the leaf blocks to the list out, each followed by a newline. Like the HTML,
+        tight list paragraphs are written as they are.
+        """
+        stack = [(self, loose)]
+        while stack:
+            block, loose = stack.pop()
+            if isinstance(block, ContainerBlock):
+                loose = block.html_frame(loose)[3]
+                stack.extend((child, loose) for child in reversed(block.children))
+            elif loose is False and type(block) is Paragraph:
+                out.append("".join(block.lines).strip() + "\n")
+            elif not (skip_code and type(block) in (IndentedCodeBlock, FencedCodeBlock)):
+                text = block.plain_text()
+                if text:
+                    out.append(text)
+
+    @staticmethod
+    @functools.lru_cache(64)
+    def split_template(template):
+        """Return the parts of a template before and after the content"""
+        start, _, end = template.partition("{content}")
+        return start, end
+
+    @staticmethod
+    def strip_output(out, start, chars):
+        """Strip chars (whitespace for None) from both ends of the fragments written to out since start"""
+        while len(out) > start:
+            last = out[-1].rstrip(chars)
+            if last:
+                out[-1] = last
+                break
+            out.pop()
+        for i in range(start, len(out)):
+            out[i] = out[i].lstrip(chars)
+            if out[i]:
+                break
+
+    @classmethod
+    def interrupts_paragraph(cls, line):
+        """Returns whether this block could start with that line even after paragraph text"""
+        return False
+
+    def end_pattern(self):
+        """Return the regular expression that matches if a line closes this block"""
+        return self._END_REGEX
 
     def get_end_regex(self):
-        """Return the compiled regular expression that matches if a line closes this block"""
-        return re.compile(self._END_REGEX)
+        """Return the compiled end regular expression, it's only compiled once per block"""
+        if self.end_regex is None:
+            self.end_regex = re.compile(self.end_pattern())
+        return self.end_regex
 
     def close_check(self, line, line_number, force=False):
-        """Mark blocks that will be closed by that line"""
+        """Mark blocks (this one and its open descendants) that will be closed by that line"""
+        block = self
+        while True:
+            block.check_end(line, line_number, force)
+            child = block.open_child()
+            if child is None:
+                return
+            line, force, block = block.strip_line(line), block.close_next, child
+
+    def check_end(self, line, line_number, force=False):
+        """Set close_next if that line closes this block"""
         pass
 
     def strip_line(self, line):
         return line
 
-    def add_line(self, line, stripped, lazy=False):
-        """Add text line to this block"""
+    def add_line(self, line, stripped, untabbed, lazy=False):
+        """Add text line to this block, line is the remainder of untabbed after the column stripped"""
         self.lines.append(line)
 
+    def open_child(self):
+        """Get the last child if it is still open (all other children are always closed)"""
+        if self.children and not self.children[-1].closed:
+            return self.children[-1]
+        return None
+
     def get_last_open(self, line):
         """Get last open block (self or child)"""
-        cur_line = self.strip_line(line)
-        line = cur_line
-        last = self
-        for child in self.children:
-            if not (child.closed or child.close_next):
-                last, line = child.get_last_open(cur_line)
-        return last, line
+        line = self.strip_line(line)
+        if self.children and not (self.children[-1].closed or self.children[-1].close_next):
+            return self.children[-1].get_last_open(line)
+        return self, line
 
     def get_last_open_types(self, block_types):
         """Get the last open block of one of the specified types"""
         ret = self if type(self) in block_types and not (self.closed or self.close_next) else None
-        for child in self.children:
-            if not child.closed or child.close_next:
-                block = child.get_last_open_types(block_types)
-                ret = block if block is not None else ret
+        if self.children and (not self.children[-1].closed or self.children[-1].close_next):
+            block = self.children[-1].get_last_open_types(block_types)
+            ret = block if block is not None else ret
         return ret
 
     def get_last(self):
@@ -87,61 +226,140 @@ class Block(object):
 
     def close_marked(self):
         """Close the blocks marked by close_check"""
-        if self.close_next:
-            self.closed = True
-        for child in self.children:
-            if not child.closed:
-                child.close_marked()
+        block = self
+        while block is not None:
+            if block.close_next:
+                block.closed = True
+            block = block.open_child()
 
 
 class LeafBlock(Block):
     """Interface for all leaf blocks (don't contain other blocks)"""
-    def close_check(self, line, line_number, force=False):
+    __slots__ = ("inlines",)
+
+    def __init__(self):
+        super().__init__()
+        # Inline tree of the text, parsed by get_inlines (or loaded from a dumped tree)
+        self.inlines = None
+
+    def check_end(self, line, line_number, force=False):
         self.close_next = True
-        return line
 
     def get_html(self):
-        lines = self.lines
-        while lines and not lines[-1].strip():
-            # Remove trailing empty lines
-            lines = lines[:-1]
-        # Parse text as inline
-        return self._TEMPLATE.format(content=InlineParser.parse("".join(lines)), **self.__dict__)
+        return self._TEMPLATE.format(content=self.inline_html(), **self.fields())
+
+    def inline_text(self):
+        """Return the text that is parsed as inlines, None for blocks without inline content"""
+        return "".join(self.content_lines())
+
+    def get_inlines(self):
+        """
+        Return the inline tree of the text, None for blocks without inline content. It's parsed on the
+        first call and kept on the block.
+        """
+        if self.inlines is None:
+            text = self.inline_text()
+            if text is not None:
+                self.inlines = InlineParser.get_inlines(text)
+        return self.inlines
+
+    def plain_text(self):
+        """Return the plain text of the inline content and a newline, an empty string for blocks without it"""
+        if self.inlines is None:
+            text = self.inline_text()
+            if text is None:
+                return ""
+            return InlineParser.get_text(InlineParser.get_inlines(text)) + "\n"
+        return InlineParser.get_text(self.inlines) + "\n"
+
+    def inline_plain_text(self):
+        """Return the plain text of the inline content, parsed like in inline_html"""
+        if self.inlines is None:
+            return InlineParser.get_text(InlineParser.get_inlines(self.inline_text()))
+        return InlineParser.get_text(self.inlines)
+
+    def inline_html(self):
+        """Return the HTML of the inline content, the text is parsed without keeping the tree if it wasn't yet"""
+        if self.inlines is None:
+            return InlineParser.parse(self.inline_text())
+        return InlineParser.get_html(self.inlines)
+
+    def content_lines(self):
+        """Return the lines without trailing empty lines"""
+        end = len(self.lines)
+        while end and not self.lines[end - 1].strip():
+            end -= 1
+        return self.lines[:end]
 
 
 # Leaf blocks
 class ThematicBreak(LeafBlock):
+    __slots__ = ()
     _TEMPLATE = "<hr />"
-    START_REGEX = re.compile(r"^ {0,3}([*\-_])[ \t]*(\1[ \t]*){2,}(\1|[ \t])*\n?$")
+    START_REGEX = re.compile(r"^ {0,3}([*\-_])[ \t]*(?:\1[ \t]*){2,}\n?$")
+
+    @classmethod
+    def interrupts_paragraph(cls, line):
+        # Lines like "---" are setext heading underlines instead
+        return cls.START_REGEX.match(line) is not None and SetextHeading.START_REGEX.match(line) is None
 
     def get_html(self):
         return self._TEMPLATE
 
+    def inline_text(self):
+        return None
+
 
 class ATXHeading(LeafBlock):
+    __slots__ = ("number",)
     _TEMPLATE = "<h{number}>{content}</h{number}>\n"
-    REGEX = re.compile(r"^ {0,3}(?P<number>[#]{1,6})([ \t]|$)(?P<content>.*?(?:(\\#)*))[ \t]*(?:[#]{2,})? *\n?$")
     START_REGEX = re.compile(r"^ {0,3}(?P<number>[#]{1,6})([ \t]|$)")
 
     def __init__(self, number=1):
         super().__init__()
         self.number = number
 
+    def fields(self):
+        return {"number": self.number}
+
     @classmethod
-    def create(cls, line, line_number, stripped=0):
-        m = cls.REGEX.match(line)
-        r = m.groupdict()
-        instance = cls(len(r['number']))
-        instance.add_line(r['content'], stripped + m.start(2))
+    def interrupts_paragraph(cls, line):
+        return cls.START_REGEX.match(line) is not None
+
+    @classmethod
+    def create(cls, line, line_number, stripped, untabbed):
+        m = cls.START_REGEX.match(line)
+        instance = cls(len(m.group('number')))
+        instance.add_line(cls.strip_closing(line[m.end():]), stripped + m.start(2), untabbed)
         return instance
 
+    @staticmethod
+    def strip_closing(content):
+        """
+        Remove the closing sequence (spaces, two or more # and spaces) from the content. String operations,
+        a lazy regex group in front of it would backtrack quadratically on long runs of spaces and tabs.
+        """
+        if content.endswith("\n"):
+            content = content[:-1]
+        content = content.rstrip(" ")
+        without_hashes = content.rstrip("#")
+        hashes = len(content) - len(without_hashes)
+        if hashes > 2 and without_hashes.endswith("\\"):
+            # An escaped # stays in the content, the rest of the run closes
+            return without_hashes + "#"
+        if hashes >= 2:
+            content = without_hashes
+        return content.rstrip(" \t")
+
 
 class SetextHeading(LeafBlock):
+    __slots__ = ()
     _TEMPLATE = "<h{number}>{content}</{number}>"
     START_REGEX = re.compile(r"^ {0,3}([=\-])\1* *\n?$")
 
 
 class IndentedCodeBlock(LeafBlock):
+    __slots__ = ()
     _TEMPLATE = "<pre><code>{content}</code></pre>"
     START_REGEX = re.compile(r"^([ ]{4}|[ ]*\t)\s*\S")
     _END_REGEX = r"^ {0,3}\S+"
@@ -154,35 +372,40 @@ class IndentedCodeBlock(LeafBlock):
                 and not ListItem.starts(last_open, line, line_number, last)
 
     @classmethod
-    def create(cls, line, line_number, stripped=0):
+    def create(cls, line, line_number, stripped, untabbed):
         instance = cls()
-        instance.add_line(line, stripped)
+        instance.add_line(line, stripped, untabbed)
         return instance
 
-    def add_line(self, line, stripped=0, lazy=False):
-        line = Document.tabs_to_spaces(line, 4, stripped)
+    def add_line(self, line, stripped, untabbed, lazy=False):
+        # Convert the tabs in the first four columns
+        line = untabbed.remainder(stripped, 4)
         # Strip first four spaces or less if there are less than four
         if line.strip() or len(line) > 4:
             self.lines.append(line[4:])
         else:
             self.lines.append(line.strip(" \t", ))
 
-    def close_check(self, line, line_number, force=False):
-        self.close_next = re.compile(self._END_REGEX).match(line) is not None or force
+    def check_end(self, line, line_number, force=False):
+        self.close_next = self.get_end_regex().match(line) is not None or force
 
     def get_html(self):
-        lines = self.lines
-        # Remove trailing blank lines
-        while lines and not lines[-1].strip():
-            lines = lines[:-1]
         # Dont't parse as inline
-        return self._TEMPLATE.format(content=html.escape("".join(lines)), **self.__dict__)
+        return self._TEMPLATE.format(content=html.escape("".join(self.content_lines())))
+
+    def plain_text(self):
+        return "".join(self.content_lines())
+
+    def inline_text(self):
+        return None
 
 
 class FencedCodeBlock(LeafBlock):
+    __slots__ = ("character", "indentation", "number", "info", "class_str")
     _TEMPLATE = "<pre><code{class_str}>{content}</code></pre>\n"
-    REGEX = re.compile(
-        r"^(?P<indentation>[ ]{0,3})(?P<fence>(?P<character>[`~])\3{2,})[ \t]*(?P<info>[^\`]*?)?[ \t]*\n?$")
+    # The info string is matched greedily and stripped in create, the fence can't give characters back to it:
+    # otherwise a failing match backtracks quadratically on long runs of spaces or fence characters
+    REGEX = re.compile(r"^(?P<indentation>[ ]{0,3})(?P<fence>(?P<character>[`~])\3{2,})(?!\3)(?P<info>[^`]*)$")
     _END_REGEX = r"^[ ]{{0,3}}[{character}]{{{number},}} *\n?$"
     START_REGEX = REGEX
 
@@ -197,19 +420,23 @@ class FencedCodeBlock(LeafBlock):
             self.class_str = ' class="language-{}"'.format(self.info.split()[0])
 
     @classmethod
-    def create(cls, line, line_number, stripped):
+    def create(cls, line, line_number, stripped, untabbed):
         r = cls.REGEX.match(line).groupdict()
-        return cls(r['character'], len(r['indentation']), len(r['fence']), r['info'])
+        return cls(r['character'], len(r['indentation']), len(r['fence']), r['info'].strip(" \t\n"))
 
-    def close_check(self, line, line_number, force=False):
+    @classmethod
+    def interrupts_paragraph(cls, line):
+        return cls.START_REGEX.match(line) is not None
+
+    def check_end(self, line, line_number, force=False):
         self.close_next = self.get_end_regex().match(line) is not None
         self.closed = self.closed or force
 
-    def get_end_regex(self):
-        return re.compile(self._END_REGEX.format(**self.__dict__))
+    def end_pattern(self):
+        return self._END_REGEX.format(character=self.character, number=self.number)
 
-    def add_line(self, line, stripped, lazy=False):
-        line = Document.tabs_to_spaces(line, self.indentation, stripped)
+    def add_line(self, line, stripped, untabbed, lazy=False):
+        line = untabbed.remainder(stripped, self.indentation)
         # Remove spaces up to indentation
         if all(c == " " for c in line[:self.indentation]):
             self.lines.append(line[self.indentation:])
@@ -220,13 +447,21 @@ class FencedCodeBlock(LeafBlock):
         # Don't parse as inline
         return self._TEMPLATE.format(content=html.escape("".join(self.lines)), class_str=self.class_str)
 
+    def plain_text(self):
+        return "".join(self.lines)
+
+    def inline_text(self):
+        return None
+
 
 class HTMLBlock(LeafBlock):
+    __slots__ = ()
     # TODO: Not supported yet
     _TEMPLATE = "{content}"
 
 
 class Paragraph(LeafBlock):
+    __slots__ = ("setextheading",)
     _TEMPLATE = "<p>{content}</p>\n"
     START_REGEX = re.compile(r"[\s]*\S+")
 
@@ -235,28 +470,29 @@ class Paragraph(LeafBlock):
         self.setextheading = False
 
     @classmethod
-    def create(cls, line, line_number, stripped):
+    def create(cls, line, line_number, stripped, untabbed):
         instance = cls()
-        instance.add_line(line, stripped)
+        instance.add_line(line, stripped, untabbed)
         return instance
     
     @classmethod
     def starts(cls, last_open, line, line_number, last):
         return type(last_open) is not Paragraph and Paragraph.START_REGEX.match(line)
 
-    def close_check(self, line, line_number, force=False):
-        self.close_next = not line.strip() or force
-        # The following interrupt paragraphs
-        if (ThematicBreak.START_REGEX.match(line) is not None and SetextHeading.START_REGEX.match(line) is None) \
-                or ATXHeading.START_REGEX.match(line) is not None \
-                or FencedCodeBlock.START_REGEX.match(line) is not None \
-                or BlockQuote.START_REGEX.match(line) is not None \
-                or BulletList.START_REGEX.match(line) is not None \
-                or (OrderedList.START_REGEX.match(line) is not None and line.startswith("1.") or line.startswith("1)")):
-            self.close_next = True
-
-    def add_line(self, line, stripped, lazy=False):
-        if SetextHeading.starts(None, line, 0, None) and self.lines and not lazy:
+    def check_end(self, line, line_number, force=False):
+        info = LineInfo.classify(line)
+        self.close_next = info.blank or force
+        # Only blocks that could start with that line may interrupt paragraphs
+        for block_type in info.candidates:
+            if block_type.interrupts_paragraph(line):
+                self.close_next = True
+                break
+
+    def add_line(self, line, stripped, untabbed, lazy=False):
+        # The text changes
+        self.inlines = None
+        if self.lines and not lazy and LineInfo.classify(line).char in SETEXT_CHARS \
+                and SetextHeading.starts(None, line, 0, None):
             # Use paragraph as Setext heading
             self.closed = True
             self.setextheading = True
@@ -267,51 +503,76 @@ class Paragraph(LeafBlock):
         else:
             self.lines.append(line.strip(" \t"))
 
+    def inline_text(self):
+        if self.setextheading:
+            # Without the underline
+            return "".join(self.lines[:-1]).strip()
+        return "".join(self.lines).strip()
+
+    def setext_level(self):
+        """Return the level of the setext heading, 1 for a "=" underline"""
+        return 1 if "=" in self.lines[-1] else 2
+
     def get_html(self):
         if self.setextheading:
-            return "<h{number}>{content}</h{number}>\n".format(number=1 if "=" in self.lines[-1] else 2,
-                                                               content=InlineParser.parse("".join(self.lines[:-1]).strip()))
+            return "<h{number}>{content}</h{number}>\n".format(number=self.setext_level(),
+                                                               content=self.inline_html())
         else:
-            return self._TEMPLATE.format(content=InlineParser.parse("".join(self.lines).strip()))
+            return self._TEMPLATE.format(content=self.inline_html())
 
 
 # Container blocks
 class ContainerBlock(Block):
+    __slots__ = ("children",)
     _TEMPLATE = "{content}"
-    _INNER_TEMPLATE = "{content}"
 
     def __init__(self):
         super().__init__()
         self.children = []
 
-    def get_html(self):
-        children_strings = [self._INNER_TEMPLATE.format(content=child.get_html())
-                            for child in self.children]
-        return self._TEMPLATE.format(content="".join(children_strings), **self.__dict__)
+    def get_html(self, sourcepos=False):
+        out = []
+        self.write_html(out, None, sourcepos)
+        return "".join(out)
+
+    def html_frame(self, loose):
+        """
+        Return the HTML before and after the content, the characters stripped from the content ("" for
+        none, None for whitespace) and the loose value of the children
+        """
+        start, end = Block.split_template(self._TEMPLATE)
+        fields = self.fields()
+        if fields:
+            return start.format(**fields), end.format(**fields), "", None
+        return start, end, "", None
 
     def add(self, block):
         """Add child to this block"""
         self.children.append(block)
 
-    def close_check(self, line, line_number, force=False):
+    def check_end(self, line, line_number, force=False):
         self.close_next = self.get_end_regex().match(line) is not None or force
-        line = self.strip_line(line)
-        for child in self.children:
-            if not child.closed:
-                child.close_check(line, line_number, force=self.close_next)
 
 
 class BlockQuote(ContainerBlock):
+    __slots__ = ()
     _TEMPLATE = "<blockquote>\n{content}</blockquote>\n"
-    REGEX = re.compile(r"^ {0,3}\>[ ]?(?P<content>.*\n?)$")
+    # Marker in front of the content
+    REGEX = re.compile(r" {0,3}\>[ ]?")
     START_REGEX = re.compile(r"^ {0,3}\>")
     _END_REGEX = re.compile(r"^(?! {0,3}\>)")
 
+    @classmethod
+    def interrupts_paragraph(cls, line):
+        return cls.START_REGEX.match(line) is not None
+
     def strip_line(self, line):
-        return self.REGEX.match(line).groupdict()['content'] if self.REGEX.match(line) else line
+        m = self.REGEX.match(line)
+        return line[m.end():] if m else line
 
 
 class ListItem(ContainerBlock):
+    __slots__ = ("indentation", "list")
     _TEMPLATE = "<li>{content}</li>\n"
     _NEWLINE_TEMPLATE = "<li>\n{content}\n</li>\n"
     REGEX = re.compile(r"^(?P<indentation>[ ]*(([\d]{1,9}[.)])|[\-+*])[ \t]*)(?P<content>.*\n?)$")
@@ -321,6 +582,15 @@ class ListItem(ContainerBlock):
         super().__init__()
         self.indentation = max(indentation, 2)
         self.start_line = start_line
+        # List this item was added to
+        self.list = None
+
+    def add(self, block):
+        if self.list is not None:
+            if self.children:
+                self.list.end_block(self.children[-1])
+            self.list.blocks += 1
+        super().add(block)
 
     @classmethod
     def starts(cls, last_open, line, line_number, last):
@@ -329,24 +599,21 @@ class ListItem(ContainerBlock):
                                                  and ListItem.REGEX.match(line)
 
     @classmethod
-    def create(cls, line, line_number, stripped):
+    def create(cls, line, line_number, stripped, untabbed):
         m = cls.REGEX.match(line)
         r = m.groupdict()
-        if r['content'] and r['content'].strip():
+        # Marker and spaces with tabs converted
+        indentation = untabbed.text[stripped:untabbed.end_column(stripped, m.end(1))]
+        if not (r['content'] and r['content'].strip()):
             # Blank first line, assume one space for indentation
-            indentation = Document.tabs_to_spaces(r['indentation'], -1, stripped + m.start(1))
-        else:
-            indentation = Document.tabs_to_spaces(r['indentation'], -1, stripped + m.start(1)).rstrip() + " "
+            indentation = indentation.rstrip() + " "
         whitespaces = re.compile(r".*?(?P<whitespaces>[ ]{5,})\n?$").match(indentation)
         if whitespaces is not None:
             indentation = indentation[:whitespaces.start(1) + 1]
         return cls(len(indentation), line_number)
 
-    def close_check(self, line, line_number, force=False):
+    def check_end(self, line, line_number, force=False):
         self.close_next = self.get_end_regex().match(line) and not line_number == self.start_line or force
-        for child in self.children:
-            if not child.closed:
-                child.close_check(self.strip_line(line), line_number, force=self.close_next)
 
     def strip_line(self, line):
         if line.find("\n") > -1:
@@ -355,27 +622,31 @@ class ListItem(ContainerBlock):
         else:
             return line[self.indentation:]
 
-    def get_end_regex(self):
-        return re.compile(self._END_REGEX.format(indentation=self.indentation - 1))
+    def end_pattern(self):
+        return self._END_REGEX.format(indentation=self.indentation - 1)
 
     def get_html(self, loose=False):
-        content = ""
-        for child in self.children:
-            if not loose and type(child) is Paragraph:
-                # Tight list, don't wrap text into <p>-tags
-                content += "".join(child.lines).strip()
-            else:
-                content += child.get_html()
-        if loose:
-            return self._NEWLINE_TEMPLATE.format(content=content.strip())
-        return self._TEMPLATE.format(content=content.strip())
+        out = []
+        self.write_html(out, loose)
+        return "".join(out)
+
+    def html_frame(self, loose):
+        start, end = Block.split_template(self._NEWLINE_TEMPLATE if loose else self._TEMPLATE)
+        return start, end, None, bool(loose)
 
 
 class List(ContainerBlock):
+    __slots__ = ("indentation", "loose", "blocks", "blank_after_sublist")
+
     def __init__(self, indentation):
         super().__init__()
         self.indentation = indentation
+        # Number of blocks in the items when the first blank line was found, -1 without blank line
         self.loose = -1
+        # Number of blocks in all items
+        self.blocks = 0
+        # A sublist ending with a blank line is followed by more blocks of this list
+        self.blank_after_sublist = False
 
     @classmethod
     def starts(cls, last_open, line, line_number, last):
@@ -384,34 +655,35 @@ class List(ContainerBlock):
     def strip_line(self, line):
         return line[self.indentation:]
 
-    def get_html(self):
-        content = ""
-        for child in self.children:
-            content += child.get_html(loose=self.is_loose())
-        return self._TEMPLATE.format(content=content.strip("\n"), **self.__dict__)
+    def add(self, item):
+        """Add a list item"""
+        if self.children and self.children[-1].children:
+            self.end_block(self.children[-1].children[-1])
+        item.list = self
+        super().add(item)
 
-    def close_check(self, line, line_number, force=False):
+    def end_block(self, block):
+        """Called when block isn't the last block of this list anymore, it doesn't change after that"""
+        if isinstance(block, List) and block.loose > -1 and not block.is_loose():
+            # Empty line at end of sublist
+            self.blank_after_sublist = True
+
+    def html_frame(self, loose):
+        start, end, _, _ = super().html_frame(loose)
+        return start, end, "\n", self.is_loose()
+
+    def check_end(self, line, line_number, force=False):
         self.close_next = self.get_end_regex().match(line) is not None \
                           or ThematicBreak.starts(None, line, line_number, None) \
                           or force
-        for child in self.children:
-            if not child.closed:
-                child.close_check(self.strip_line(line), line_number, force=self.close_next)
 
     def is_loose(self):
-        """Check if list is loose"""
-        loose = -1 < self.loose < sum([len(c.children) for c in self.children])
-        # Checking for trailing blank lines in sublist that make this list loose
-        for child in self.children:
-            for l in child.children:
-                if issubclass(type(l), List):
-                    if l.loose > -1 and not l.is_loose() and l is not self.children[-1].children[-1]:
-                        # Empty line at end of list
-                        return True
-        return loose
+        """Check if list is loose: a block follows a blank line, or a sublist ending with one"""
+        return -1 < self.loose < self.blocks or self.blank_after_sublist
 
 
 class OrderedList(List):
+    __slots__ = ("start_num", "start", "marker")
     _TEMPLATE = "<ol{start}>\n{content}\n</ol>\n"
     START_REGEX = re.compile(r"^(?P<indentation>[ ]{0,3})(?P<start>[\d]{1,9})(?P<marker>[.)])([ \t]|$)")
     _END_REGEX = r"^(?!([\d]{{1,9}}[{marker}])|(?![ ]{{0,{indentation}}}\S.*))"
@@ -424,6 +696,9 @@ class OrderedList(List):
         self.marker = marker
         self.indentation = indentation
 
+    def fields(self):
+        return {"start": self.start}
+
     @classmethod
     def starts(cls, last_open, line, line_number, last):
         return cls.START_REGEX.match(line) is not None \
@@ -431,21 +706,27 @@ class OrderedList(List):
                and not (type(last_open) is Paragraph and cls.START_REGEX.match(line).groupdict()['start'] != 1)
 
     @classmethod
-    def create(cls, line, line_number, stripped):
+    def interrupts_paragraph(cls, line):
+        return cls.START_REGEX.match(line) is not None and line.startswith("1.") or line.startswith("1)")
+
+    @classmethod
+    def create(cls, line, line_number, stripped, untabbed):
         m = cls.START_REGEX.match(line)
         r = m.groupdict()
         instance = cls(len(r['indentation']), int(r['start']), r['marker'])
-        instance.add(ListItem.create(instance.strip_line(line), line_number, stripped + instance.indentation))
+        instance.add(ListItem.create(instance.strip_line(line), line_number, stripped + instance.indentation,
+                                     untabbed))
         return instance
 
-    def get_end_regex(self):
+    def end_pattern(self):
         if self.indentation > 0:
-            return re.compile(self._END_REGEX.format(indentation=self.indentation - 1, marker=re.escape(self.marker)))
+            return self._END_REGEX.format(indentation=self.indentation - 1, marker=re.escape(self.marker))
         else:
-            return re.compile(self._ALT_END_REGEX.format(marker=re.escape(self.marker)))
+            return self._ALT_END_REGEX.format(marker=re.escape(self.marker))
 
 
 class BulletList(List):
+    __slots__ = ("marker",)
     _TEMPLATE = "<ul>\n{content}</ul>\n"
     START_REGEX = re.compile(r"^(?P<indentation>[ ]{0,3})(?P<marker>[\-+*])([ \t]|$)")
     _END_REGEX = r"^([ ]{{0,{indentation}}}\S.*|[ ]{{{indentation}}}[^{marker}^\s])"
@@ -457,64 +738,266 @@ class BulletList(List):
         self.indentation = indentation
 
     @classmethod
-    def create(cls, line, line_number, stripped):
+    def interrupts_paragraph(cls, line):
+        return cls.START_REGEX.match(line) is not None
+
+    @classmethod
+    def create(cls, line, line_number, stripped, untabbed):
         m = cls.START_REGEX.match(line)
         r = m.groupdict()
         instance = cls(len(r['indentation']), r['marker'])
-        instance.add(ListItem.create(instance.strip_line(line), line_number, stripped + instance.indentation))
+        instance.add(ListItem.create(instance.strip_line(line), line_number, stripped + instance.indentation,
+                                     untabbed))
         return instance
 
-    def get_end_regex(self):
+    def end_pattern(self):
         if self.indentation > 0:
-            return re.compile(self._END_REGEX.format(indentation=self.indentation - 1, marker=re.escape(self.marker)))
+            return self._END_REGEX.format(indentation=self.indentation - 1, marker=re.escape(self.marker))
+        else:
+            return self._ALT_END_REGEX.format(marker=re.escape(self.marker))
+
+
+SETEXT_CHARS = ("=", "-")
+BULLET_CHARS = ("-", "+", "*")
+
+
+class LineInfo(object):
+    """Classification of a line: indentation, first significant character and the blocks it could start"""
+    __slots__ = ("indented", "char", "blank", "candidates")
+    # Blocks that could start with a character after up to three spaces, in the order they are tried
+    _CANDIDATES = {
+        "#": (ATXHeading,),
+        "*": (ThematicBreak, ListItem, BulletList),
+        "-": (ThematicBreak, ListItem, BulletList),
+        "_": (ThematicBreak,),
+        "+": (ListItem, BulletList),
+        "`": (FencedCodeBlock,),
+        "~": (FencedCodeBlock,),
+        ">": (BlockQuote,),
+        "\t": (IndentedCodeBlock,),
+    }
+
+    INDENTATION_REGEX = re.compile(r"[ ]*")
+
+    def __init__(self, indented, char, blank):
+        self.indented = indented
+        self.char = char
+        self.blank = blank
+        if self.blank:
+            self.candidates = ()
+            return
+        digit = self.char.isdecimal()
+        if self.indented:
+            # Only list items may be indented arbitrarily
+            candidates = (IndentedCodeBlock, ListItem) if digit or self.char in BULLET_CHARS else (IndentedCodeBlock,)
+        elif digit:
+            candidates = (ListItem, OrderedList)
         else:
-            return re.compile(self._ALT_END_REGEX.format(marker=re.escape(self.marker)))
+            candidates = self._CANDIDATES.get(self.char, ())
+        self.candidates = candidates + (Paragraph,)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def classify(line):
+        """Get the (shared) classification of a line"""
+        indentation = LineInfo.INDENTATION_REGEX.match(line).end()
+        # Lines are only looked at up to their first significant character, long ones aren't copied
+        blank = indentation == len(line) or line.isspace()
+        return LineInfo.get(indentation > 3, line[indentation:indentation + 1], blank)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def get(indented, char, blank):
+        return LineInfo(indented, char, blank)
+
+
+class UntabbedLine(object):
+    """
+    A line with all tabs converted to spaces with a tab stop of 4, in a single pass. The columns of the
+    tabs map between characters of the line and columns of the text, remainders after a column are
+    taken from it.
+    """
+    __slots__ = ("line", "text", "tabs", "starts")
+
+    def __init__(self, line):
+        self.line = line
+        # Index of every tab in line and its column in text
+        self.tabs = self.starts = ()
+        index = line.find("\t")
+        if index < 0:
+            self.text = line
+            return
+        self.tabs = []
+        self.starts = []
+        parts = []
+        pos = 0
+        column = 0
+        while index > -1:
+            column += index - pos
+            self.tabs.append(index)
+            self.starts.append(column)
+            parts.append(line[pos:index])
+            parts.append(" " * (4 - column % 4))
+            column += 4 - column % 4
+            pos = index + 1
+            index = line.find("\t", pos)
+        parts.append(line[pos:])
+        self.text = "".join(parts)
+
+    def after_tab(self, tab):
+        """Get the index and column of the character after the first tab tabs"""
+        if tab == 0:
+            return 0, 0
+        start = self.starts[tab - 1]
+        return self.tabs[tab - 1] + 1, start + 4 - start % 4
+
+    def column(self, index):
+        """Get the column of the character at index"""
+        after, column = self.after_tab(bisect.bisect_left(self.tabs, index))
+        return column + index - after
+
+    def position(self, column):
+        """Get the index of the first character at or after column and its column"""
+        # Characters between two tabs take one column each
+        after, after_column = self.after_tab(bisect.bisect_left(self.starts, column))
+        index = min(len(self.line), after + max(0, column - after_column))
+        return index, after_column + index - after
+
+    def remainder(self, column, expand=0):
+        """Get the line after column with only the tabs starting before column + expand converted"""
+        if not self.tabs:
+            return self.line[column:]
+        index, end = self.position(column + expand)
+        return self.text[column:end] + self.line[index:]
+
+    def end_column(self, column, length):
+        """Get the column after the first length characters of remainder(column)"""
+        if not self.tabs:
+            return column + length
+        index, end = self.position(column)
+        if length <= end - column:
+            return column + length
+        return self.column(index + length - (end - column))
 
 
 class Document(ContainerBlock):
+    __slots__ = ("spine", "line_index")
     _TEMPLATE = "{content}"
+    # Container blocks aren't nested deeper, further markers are text. Every level costs a copy of
+    # the rest of the line, this keeps lines of thousands of ">" linear.
+    MAX_DEPTH = 100
+
+    def __init__(self):
+        super().__init__()
+        # Chain of last children from the document down to the most recently added block.
+        # Only blocks on this chain can still be open, so all per-line checks walk it instead of the tree.
+        self.spine = [self]
+        # Start lines of the first top-level blocks, extended by render_range
+        self.line_index = []
+
+    def add_block(self, parent, block):
+        """Add block as child of parent, which has to be on the spine"""
+        del self.spine[parent.depth + 1:]
+        parent.add(block)
+        while block is not None:
+            block.depth = len(self.spine)
+            self.spine.append(block)
+            block = block.children[-1] if block.children else None
 
     def close_check(self, line, line_number, force=False):
-        for child in self.children:
-            if not child.closed:
-                child.close_check(line, line_number, force)
+        child = self.open_child()
+        if child is not None:
+            child.close_check(line, line_number, force)
+
+    def get_last_open(self, line, start=1):
+        """Get the last open block and the line stripped by it, start is the spine position the line belongs to"""
+        spine = self.spine
+        last = spine[start - 1]
+        for i in range(start, len(spine)):
+            block = spine[i]
+            if block.closed or block.close_next:
+                break
+            last, line = block, block.strip_line(line)
+        return last, line
+
+    def get_last_open_types(self, block_types):
+        ret = None
+        for block in self.spine[1:]:
+            if block.closed and not block.close_next:
+                break
+            if type(block) in block_types and not (block.closed or block.close_next):
+                ret = block
+        return ret
+
+    def get_last(self):
+        return self.spine[-1]
+
+    def pop_html(self, count):
+        """Return the HTML of the first count top-level blocks and remove them from the document"""
+        out = []
+        for child in self.children[:count]:
+            child.write_html(out)
+        del self.children[:count]
+        del self.line_index[:count]
+        return "".join(out)
+
+    def outline(self):
+        """
+        Return (level, plain text, start line) of every heading the HTML has. Only the heading texts
+        are parsed as inlines, nothing is rendered.
+        """
+        headings = []
+        # Blocks with the loose value of their list like in write_html
+        stack = [(self, None)]
+        while stack:
+            block, loose = stack.pop()
+            if isinstance(block, ContainerBlock):
+                loose = block.html_frame(loose)[3]
+                stack.extend((child, loose) for child in reversed(block.children))
+            elif type(block) is ATXHeading:
+                headings.append((block.number, block.inline_plain_text(), block.start_line))
+            elif type(block) is Paragraph and block.setextheading and loose is not False:
+                # Tight list paragraphs are written as they are, even setext headings
+                headings.append((block.setext_level(), block.inline_plain_text(), block.start_line))
+        return headings
+
+    def pop_text(self, count, skip_code=False):
+        """Return the plain text of the first count top-level blocks and remove them from the document"""
+        out = []
+        for child in self.children[:count]:
+            child.write_text(out, None, skip_code)
+        del self.children[:count]
+        del self.line_index[:count]
+        return "".join(out)
+
+    def render_range(self, first_line, last_line, sourcepos=False):
+        """
+        Return the HTML of the top-level blocks that overlap the source lines first_line to last_line
+        (counted from 0). The blocks are found by bisecting their start lines, only they are rendered.
+        """
+        index = self.line_index
+        index.extend(child.start_line for child in self.children[len(index):])
+        # Top-level blocks don't overlap, the block starting last before first_line may end before it
+        i = max(bisect.bisect_right(index, first_line) - 1, 0)
+        if i < len(index) and self.children[i].end_line < first_line:
+            i += 1
+        out = []
+        for child in self.children[i:bisect.bisect_right(index, last_line)]:
+            child.write_html(out, None, sourcepos)
+        return "".join(out)
 
     @staticmethod
-    def new_block(last_open, line, line_number, last, stripped):
+    def new_block(last_open, line, line_number, last, stripped, untabbed):
         """Find a new block that starts with this line"""
-        block = None
         if type(last_open) is IndentedCodeBlock or type(last_open) is FencedCodeBlock:
-            block = None
-        elif ATXHeading.starts(last_open, line, line_number, last):
-            block = ATXHeading.create(line, line_number, stripped)
-        elif ThematicBreak.starts(last_open, line, line_number, last):
-            if type(last_open) is Paragraph and SetextHeading.starts(last_open, line, line_number, last):
-                block = None
-            else:
-                block = ThematicBreak.create(line, line_number, stripped)
-        elif IndentedCodeBlock.starts(last_open, line, line_number, last):
-            block = IndentedCodeBlock.create(line, line_number, stripped)
-        elif FencedCodeBlock.starts(last_open, line, line_number, last):
-            block = FencedCodeBlock.create(line, line_number, stripped)
-        elif ListItem.starts(last_open, line, line_number, last):
-            block = ListItem.create(line, line_number, stripped)
-        elif OrderedList.starts(last_open, line, line_number, last):
-            block = OrderedList.create(line, line_number, stripped)
-        elif BulletList.starts(last_open, line, line_number, last):
-            block = BulletList.create(line, line_number, stripped)
-        elif BlockQuote.starts(last_open, line, line_number, last):
-            block = BlockQuote.create(line, line_number, stripped)
-        elif Paragraph.starts(last_open, line, line_number, last):
-            block = Paragraph.create(line, line_number, stripped)
-        return block
-
-    @staticmethod
-    def tabs_to_spaces(line, indentation, stripped):
-        """Convert tabs to spaces with a tab stop of 4"""
-        indent = len(line) if indentation < 0 else indentation
-        while "\t" in line[:indent]:
-            index = line.find("\t")
-            if index < indent:
-                line = line.replace("\t", [4, 3, 2, 1][(index + stripped) % 4] * " ", 1)
-            indent = len(line) if indentation < 0 else indentation
-        return line
+            return None
+        # Only try the blocks that could start with the first significant character
+        for block_type in LineInfo.classify(line).candidates:
+            if last_open.depth >= Document.MAX_DEPTH and issubclass(block_type, ContainerBlock):
+                continue
+            if block_type.starts(last_open, line, line_number, last):
+                if block_type is ThematicBreak and type(last_open) is Paragraph \
+                        and SetextHeading.starts(last_open, line, line_number, last):
+                    return None
+                return block_type.create(line, line_number, stripped, untabbed)
+        return None
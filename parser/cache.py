@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    Thread-safe least recently used cache, bounded by the total size of its values.
+    With a ttl entries expire after that many seconds. Concurrent get_or_compute calls
+    for the same missing key share a single computation. With count_keys the size of the
+    keys counts as well.
+    """
+    def __init__(self, max_size, ttl=None, size=len, count_keys=False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = size
+        self.count_keys = count_keys
+        # key -> (value, size, expiry time)
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+        # Running computations by key
+        self.computing = {}
+
+    def get(self, key, default=None):
+        with self.lock:
+            found, value = self.lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.store(key, value)
+
+    def get_or_compute(self, key, function, *args):
+        """Get the value of key, compute it with function(*args) if it's missing"""
+        with self.lock:
+            found, value = self.lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            computation = self.computing.get(key)
+            leader = computation is None
+            if leader:
+                self.misses += 1
+                computation = self.computing[key] = Computation()
+            else:
+                # Another thread computes the value already
+                self.hits += 1
+        if not leader:
+            return computation.wait()
+        try:
+            computation.value = function(*args)
+        except BaseException as e:
+            computation.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.computing[key]
+                if computation.error is None:
+                    self.store(key, computation.value)
+            computation.done.set()
+        return computation.value
+
+    def lookup(self, key):
+        """Get (found, value), the lock has to be held"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[2] is not None and entry[2] < time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry[0]
+
+    def store(self, key, value):
+        """Add value and evict the least recently used entries, the lock has to be held"""
+        size = self.size(value) + (self.size(key) if self.count_keys else 0)
+        if key in self.entries:
+            self.remove(key)
+        if size > self.max_size:
+            # Would evict everything else
+            return
+        self.entries[key] = (value, size, time.monotonic() + self.ttl if self.ttl else None)
+        self.total_size += size
+        while self.total_size > self.max_size:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        self.total_size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations, "entries": len(self.entries), "size": self.total_size,
+                    "max_size": self.max_size}
+
+
+class Computation(object):
+    """Value computed by one thread for others to wait on"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
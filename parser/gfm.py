@@ -18,45 +18,181 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from .blocks import *
+from .inlines import InlineParser
+from .stats import ParserStats
+import locale
+import mmap
+import time
 
 
 class GFMParser():
-    def __init__(self):
+    def __init__(self, stats=False, hook=None):
+        """
+        With stats, self.stats records the time of the block, inline and render phases and counts
+        lines, blocks and inlines. hook is called with it after each rendered document.
+        """
         self.document = Document()
         self.line_number = 0
         self.last_strip = 0
         self.lazy = False
+        self.stats = ParserStats() if stats else None
+        self.hook = hook
 
     def reset(self):
         self.document = Document()
         self.line_number = 0
+        if self.stats is not None:
+            self.stats = ParserStats()
 
     def parse_text(self, text):
-        lines = text.split("\n")
-        lines = [l + "\n" for l in lines[:-1]] + [lines[-1]]
+        for line in GFMParser.text_lines(text):
+            self.parse_line(line)
+        return self
+
+    def parse_stream(self, lines):
+        """Parse an iterable of lines (e.g. an open file) without reading it completely first"""
+        for line in GFMParser.split_lines(lines):
+            self.parse_line(line)
+        return self
+
+    def parse_file(self, path, encoding=None, use_mmap=False):
+        """Parse file line by line, see read_lines"""
+        return self.parse_stream(GFMParser.read_lines(path, encoding, use_mmap))
+
+    @staticmethod
+    def text_lines(text):
+        """Yield the lines of text including their newline, the last one is empty after a trailing newline"""
+        pos = 0
+        end = text.find("\n")
+        while end > -1:
+            yield text[pos:end + 1]
+            pos = end + 1
+            end = text.find("\n", pos)
+        yield text[pos:]
+
+    @staticmethod
+    def read_lines(path, encoding=None, use_mmap=False):
+        """
+        Yield the lines of a file, with universal newlines like a file opened in text mode.
+        With use_mmap the file is memory-mapped and only the current line is decoded, which is
+        faster for huge files. The encoding has to be ASCII compatible then.
+        """
+        if not use_mmap:
+            with open(path, encoding=encoding) as f:
+                yield from f
+            return
+        encoding = encoding or locale.getpreferredencoding(False)
+        with open(path, "rb") as f:
+            if not f.seek(0, 2):
+                # Empty files can't be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for line in iter(m.readline, b""):
+                    line = line.decode(encoding)
+                    if "\r" in line:
+                        lines = GFMParser.text_lines(line.replace("\r\n", "\n").replace("\r", "\n"))
+                        yield from (l for l in lines if l)
+                    else:
+                        yield line
+
+    @staticmethod
+    def split_lines(lines):
+        """Yield lines (e.g. of a file) like parse_text splits text, an empty line follows a trailing newline"""
+        last = "\n"
+        for line in lines:
+            yield line
+            last = line
+        if last.endswith("\n"):
+            yield ""
+
+    def stream_html(self, lines):
+        """
+        Parse lines and yield the HTML of the top-level blocks as soon as it can't change anymore,
+        which is the case for all but the last one. Yielded blocks are removed from the document.
+        """
         for line in lines:
             self.parse_line(line)
+            if len(self.document.children) > 1:
+                yield self.render(self.document.pop_html, len(self.document.children) - 1)
+        if self.document.children:
+            yield self.render(self.document.pop_html, len(self.document.children))
+        if self.hook is not None:
+            self.hook(self.stats)
+
+    def write_html(self, lines, out):
+        """Parse lines and write the HTML to the file out while parsing"""
+        for html in self.stream_html(lines):
+            out.write(html)
         return self
 
+    def stream_text(self, lines, skip_code=False):
+        """Like stream_html, but yield the plain text of the top-level blocks (see get_text)"""
+        for line in lines:
+            self.parse_line(line)
+            if len(self.document.children) > 1:
+                yield self.render(self.document.pop_text, len(self.document.children) - 1, skip_code)
+        if self.document.children:
+            yield self.render(self.document.pop_text, len(self.document.children), skip_code)
+
+    def write_text(self, lines, out, skip_code=False):
+        """Parse lines and write the plain text to the file out while parsing"""
+        for text in self.stream_text(lines, skip_code):
+            out.write(text)
+        return self
+
+    def can_restart(self):
+        """
+        Check if a new parser with the same lazy and last_strip values would continue like this one,
+        given that the next line starts a new top-level block: no block is open anymore, except blocks
+        that are closed by any line.
+        """
+        spine = self.document.spine
+        if len(spine) == 2 and type(spine[1]) in [ATXHeading, ThematicBreak]:
+            return True
+        return all(block.closed for block in spine[1:])
+
     def parse_line(self, line):
         """
         Parse single line in context of previous lines in document
         """
+        if self.stats is None:
+            self.parse_blocks(line)
+            return
+        start = time.perf_counter()
+        self.parse_blocks(line)
+        self.stats.block_seconds += time.perf_counter() - start
+        self.stats.lines += 1
+
+    def parse_blocks(self, line):
+        """Add line to the block structure"""
+        last = self.document.spine[-1]
+        if type(last) is Paragraph and last.depth == 1 and not (last.closed or last.close_next):
+            info = LineInfo.classify(line)
+            if len(info.candidates) == 1 and info.char not in SETEXT_CHARS:
+                # Text that can only continue a top-level paragraph, the steps below would just add it
+                self.lazy = self.lazy or self.last_strip > 0
+                self.last_strip = 0
+                last.add_line(line, 0, None, self.lazy)
+                last.end_line = self.line_number
+                self.line_number += 1
+                return
+        # Convert tabs to spaces for finding block structure, once for all blocks using the line
+        untabbed = UntabbedLine(line)
+        line_untabbed = untabbed.text
+        # One or more blocks may be closed
+        self.document.close_check(line_untabbed, self.line_number)
+        # Get last open block and the line without indentation
+        last_open, remainder_untabbed = self.document.get_last_open(line_untabbed)
         while True:
-            # Convert tabs to spaces for finding block structure
-            line_untabbed = Document.tabs_to_spaces(line, -1, 0)
-            # One or more blocks may be closed
-            self.document.close_check(line_untabbed, self.line_number)
-            # Get last open block and the line without indentation
-            last_open, remainder = self.document.get_last_open(line_untabbed)
             # Get last, maybe closed, block
             last = self.document.get_last()
             # Calc length of indentation
-            to_strip = len(line_untabbed) - len(remainder)
+            to_strip = len(line_untabbed) - len(remainder_untabbed)
             # Get remainder, but only convert tabs needed as spaces
-            remainder = Document.tabs_to_spaces(line, to_strip, 0)[to_strip:]
+            remainder = untabbed.remainder(to_strip)
             # Get a newly started block if there is any
-            block = self.document.new_block(last_open, remainder, self.line_number, last, stripped=to_strip)
+            block = self.document.new_block(last_open, remainder, self.line_number, last, to_strip, untabbed)
+            blank = LineInfo.classify(remainder).blank
             # If no indentation is there anymore, the line could be a lazy continuation line
             self.lazy = to_strip == 0 and (self.lazy or self.last_strip > 0)
             self.last_strip = to_strip
@@ -66,9 +202,9 @@ class GFMParser():
                     self.document.close_marked()
                 else:
                     # Line must belong to fenced code block
-                    last.add_line(remainder, to_strip, self.lazy)
+                    last.add_line(remainder, to_strip, untabbed, self.lazy)
                 break
-            if block is None and not remainder.strip() and \
+            if block is None and blank and \
                     type(last_open) not in [BlockQuote, FencedCodeBlock, IndentedCodeBlock]:
                 # Empty line, if it's in a list the list could be loose
                 # Find last open list
@@ -77,10 +213,10 @@ class GFMParser():
                         (len(last_list.children[-1].children) or last_list.children[-1].start_line < self.line_number):
                     if last_list.loose < 0:
                         # List has been tight, set number of current child to indicate point of blank line
-                        last_list.loose = sum([len(c.children) for c in last_list.children])
+                        last_list.loose = last_list.blocks
                     self.document.close_marked()
                     break
-            if self.lazy and not remainder.strip() and not type(last_open) in [FencedCodeBlock, IndentedCodeBlock]:
+            if self.lazy and blank and not type(last_open) in [FencedCodeBlock, IndentedCodeBlock]:
                 # Empty continuation line not possible -> discard
                 self.document.close_marked()
                 break
@@ -89,19 +225,66 @@ class GFMParser():
                 while type(last_open) in [BulletList, OrderedList]:
                     last_open.close_check(line, self.line_number, force=True)
                     last_open.close_marked()
-                    last_open, remainder = self.document.get_last_open(line_untabbed)
+                    last_open, remainder_untabbed = self.document.get_last_open(line_untabbed)
+                # Check the line again
+                self.document.close_check(line_untabbed, self.line_number)
+                last_open, remainder_untabbed = self.document.get_last_open(line_untabbed)
                 continue
             if block is None or (type(block) is Paragraph and type(last) is Paragraph and not last.closed):
                 # Incorporate text into last block
-                last.add_line(remainder, to_strip, self.lazy)
+                last.add_line(remainder, to_strip, untabbed, self.lazy)
                 break
             else:
                 # new block starts, create it and close open
-                self.document.close_marked()
-                last_open.add(block)
+                last_open.close_marked()
+                self.document.add_block(last_open, block)
+                for added in self.document.spine[block.depth:]:
+                    added.start_line = self.line_number
+                    if self.stats is not None:
+                        self.stats.add_block(added)
                 if not issubclass(type(block), ContainerBlock):
                     break
+                # Check the rest of the line from the new block on, the blocks before it are still open
+                block.close_check(remainder_untabbed, self.line_number)
+                last_open, remainder_untabbed = self.document.get_last_open(remainder_untabbed, block.depth)
+        if line and not line.isspace():
+            # The line belongs to the blocks on the spine, only to the open ones if the rest of it is blank
+            spine = self.document.spine
+            for i in range(1, last_open.depth + 1 if blank else len(spine)):
+                spine[i].end_line = self.line_number
         self.line_number += 1
 
-    def get_html(self):
-        return self.document.get_html()
+    def get_html(self, sourcepos=False):
+        """Return the HTML of the document, with sourcepos the tags carry data-sourcepos="first-last" lines"""
+        html = self.render(self.document.get_html, sourcepos)
+        if self.hook is not None:
+            self.hook(self.stats)
+        return html
+
+    def get_text(self, skip_code=False):
+        """
+        Return the plain text of the document without tags and escaping, every leaf block on its own lines.
+        With skip_code code blocks are left out.
+        """
+        return self.render(self.document.get_text, skip_code)
+
+    def outline(self):
+        """Return (level, plain text, start line) of the headings without rendering the document"""
+        return self.render(self.document.outline)
+
+    def render_range(self, first_line, last_line, sourcepos=False):
+        """Return the HTML of the top-level blocks that overlap the lines first_line to last_line (from 0)"""
+        return self.render(self.document.render_range, first_line, last_line, sourcepos)
+
+    def render(self, function, *args):
+        """Return function(*args), recording the time of inline parsing and rendering with stats"""
+        if self.stats is None:
+            return function(*args)
+        InlineParser.recording.stats = self.stats
+        inline_seconds = self.stats.inline_seconds
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            InlineParser.recording.stats = None
+            self.stats.render_seconds += time.perf_counter() - start - (self.stats.inline_seconds - inline_seconds)
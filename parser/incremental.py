@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .gfm import GFMParser
+
+
+class ParsedBlock(object):
+    """Rendered top-level block of an IncrementalDocument"""
+    __slots__ = ("start", "clean", "lazy", "last_strip", "html")
+
+    def __init__(self, start, clean, lazy, last_strip):
+        # First source line of the block, without the pending shift of the IncrementalDocument
+        self.start = start
+        # Whether a new parser starting at that line gets the same result (see GFMParser.can_restart)
+        # if it's given the lazy and last_strip values before that line
+        self.clean = clean
+        self.lazy = lazy
+        self.last_strip = last_strip
+        self.html = ""
+
+
+class IncrementalDocument(object):
+    """
+    Document that is only re-parsed around edits.
+    After an edit, parsing restarts at the last top-level block before the edit that a new parser
+    can start with, and stops as soon as a block starts at a line after the edit where a new parser
+    could have started in the previous parse as well. All blocks from there on are reused.
+    The reused blocks aren't moved one by one: blocks from index shift_from on start shift lines
+    after their start attribute, an edit only moves shift_from over the blocks since the last edit.
+    """
+    def __init__(self, text=""):
+        self.text = ""
+        self.lines = []
+        self.blocks = []
+        self.shift_from = 0
+        self.shift = 0
+        self.set_text(text)
+
+    def set_text(self, text):
+        """Replace the whole text"""
+        self.text = text
+        self.lines = list(GFMParser.text_lines(text))
+        self.blocks = []
+        self.shift_from = 0
+        self.shift = 0
+        self.blocks = self.parse(0, -1, 0)[0]
+        return self
+
+    def start(self, index):
+        """Return the first source line of the block at index"""
+        block = self.blocks[index]
+        return block.start + self.shift if index >= self.shift_from else block.start
+
+    def find(self, line):
+        """Return the index of the first block that starts at line or later"""
+        low, high = 0, len(self.blocks)
+        while low < high:
+            middle = (low + high) // 2
+            if self.start(middle) < line:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def move_shift(self, index):
+        """Let the pending shift start at the block at index, the blocks in between get it added or removed"""
+        if index > self.shift_from:
+            for block in self.blocks[self.shift_from:index]:
+                block.start += self.shift
+        else:
+            for block in self.blocks[index:self.shift_from]:
+                block.start -= self.shift
+        self.shift_from = index
+
+    def edit(self, offset, deleted, inserted):
+        """Replace deleted characters at offset with the inserted text"""
+        text = self.text
+        end = offset + deleted
+        if offset < 0 or deleted < 0 or end > len(text):
+            raise ValueError("Edit out of range")
+        # Changed lines, in old line numbers
+        first = text.count("\n", 0, offset)
+        last = first + text.count("\n", offset, end)
+        first_start = text.rfind("\n", 0, offset) + 1
+        last_start = text.rfind("\n", 0, end) + 1
+        new_lines = list(GFMParser.text_lines(text[first_start:offset] + inserted + self.lines[last][end - last_start:]))
+        if last < len(self.lines) - 1:
+            # The last changed line keeps its newline, don't add another line after it
+            new_lines.pop()
+        delta = len(new_lines) - (last - first + 1)
+        self.text = text[:offset] + inserted + text[end:]
+        self.lines[first:last + 1] = new_lines
+
+        # Restart at the last clean block that starts before the first changed line, a block starting
+        # at a changed line may be gone (e.g. its line became blank and belongs to the previous block)
+        restart = self.find(first) - 1
+        while restart >= 0 and not self.blocks[restart].clean:
+            restart -= 1
+        if restart < 0:
+            blocks, resync = self.parse(0, last + delta, delta)
+            restart = 0
+        else:
+            block = self.blocks[restart]
+            blocks, resync = self.parse(self.start(restart), last + delta, delta, block.lazy, block.last_strip)
+        # The reused blocks move by delta lines, the new ones have their lines already
+        self.move_shift(resync)
+        self.shift += delta
+        self.blocks[restart:resync] = blocks
+        self.shift_from = restart + len(blocks)
+        return self
+
+    def parse(self, start, changed, delta, lazy=False, last_strip=0):
+        """
+        Parse lines from start, until a block starts after the changed line where the previous parse
+        started a clean block (old line numbers are shifted by delta).
+        Returns the new blocks and the index of the first reused old block.
+        """
+        parser = GFMParser()
+        parser.line_number = start
+        parser.lazy = lazy
+        parser.last_strip = last_strip
+        children = parser.document.children
+        blocks = []
+        for i in range(start, len(self.lines)):
+            clean = parser.can_restart()
+            lazy, last_strip = parser.lazy, parser.last_strip
+            count = len(children)
+            parser.parse_line(self.lines[i])
+            if len(children) == count:
+                continue
+            if clean and i > changed and len(children) == count + 1:
+                # Old block at the same line, the rest of the document is parsed the same way
+                j = self.find(i - delta)
+                if j < len(self.blocks) and self.start(j) == i - delta and self.blocks[j].clean \
+                        and self.blocks[j].lazy == lazy and self.blocks[j].last_strip == last_strip:
+                    self.render(children[:-1], blocks)
+                    return blocks, j
+            for _ in range(len(children) - count):
+                blocks.append(ParsedBlock(i, clean and len(children) == count + 1, lazy, last_strip))
+        self.render(children, blocks)
+        return blocks, len(self.blocks)
+
+    @staticmethod
+    def render(children, blocks):
+        for child, block in zip(children, blocks):
+            block.html = child.get_html()
+
+    def get_html(self):
+        return "".join([block.html for block in self.blocks])
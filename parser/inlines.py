@@ -20,206 +20,321 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import re
 import string
 import html
+import threading
+import time
+from .cache import LRUCache
 
 
 class InlineParser(object):
+    AUTOLINK_REGEX = re.compile(r"<(?P<link>(?P<scheme>[a-zA-Z][a-zA-Z+-.]+?):[^\s<>]*?)>")
+    EMAIL_AUTOLINK_REGEX = re.compile(
+        r"<(?P<address>[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?"
+        r"(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*)>")
+    BACKTICKS_REGEX = re.compile(r"`+")
+    DELIMITER_REGEX = re.compile(r"[*]+|[_]+|\[|!\[|]")
+    # Space runs only match from their start, else each space of a long run not ending a line is tried again
+    HARD_BREAK_REGEX = re.compile(r"(?P<break>(?<! )[ ]{2,}|\t|[\\])\n")
+    ESCAPED_REGEX = re.compile(r"\\(?P<char>[{}])".format(re.escape(string.punctuation)))
+    # Characters that can't be in front of a closing delimiter run
+    NO_PRE_CHARACTERS = "_*]!["
+    # Default bound of the memo in characters of texts and HTML
+    MEMO_SIZE = 16 * 1024 * 1024
+    # Process-wide memo of the HTML by text, see enable_memo
+    memo = None
+    # ParserStats of the current thread's rendering (recording.stats), see GFMParser(stats=True)
+    recording = threading.local()
+
+    @staticmethod
+    def enable_memo(max_size=MEMO_SIZE):
+        """
+        Remember the HTML of parsed texts, so texts that recur in documents or between
+        edits are only parsed once. memo.stats() returns the hit and miss counters.
+        """
+        InlineParser.memo = LRUCache(max_size, count_keys=True)
+
+    @staticmethod
+    def disable_memo():
+        InlineParser.memo = None
+
     @staticmethod
     def parse(input_string):
-        parts = [Text(input_string)]
-        parts = InlineParser.compute(InlineParser.get_autolinks, [], parts)
-        parts = InlineParser.compute(InlineParser.get_emailautolinks, [Autolink], parts)
-        parts = InlineParser.compute(InlineParser.get_code_spans, [Autolink, EMailAutolink], parts)
-        parts = InlineParser.compute(InlineParser.get_emphasis, [CodeSpan, Autolink, EMailAutolink], parts)
-        parts = InlineParser.compute(InlineParser.get_hard_breaks, [CodeSpan, Autolink, EMailAutolink], parts)
-        parts = InlineParser.compute(InlineParser.unescape, [CodeSpan, Autolink, EMailAutolink], parts)
-        return "".join([e.get_html() for e in parts])
+        stats = getattr(InlineParser.recording, "stats", None)
+        if stats is None:
+            return InlineParser.lookup(input_string)
+        start = time.perf_counter()
+        result = InlineParser.lookup(input_string, stats)
+        stats.inline_seconds += time.perf_counter() - start
+        stats.inline_texts += 1
+        return result
 
     @staticmethod
-    def compute(function, exceptions, parts):
+    def lookup(input_string, stats=None):
+        """Get the HTML from the memo or render it"""
+        memo = InlineParser.memo
+        if memo is None:
+            return InlineParser.render(input_string, stats)
+        result = memo.get(input_string)
+        if result is None:
+            result = InlineParser.render(input_string, stats)
+            memo.put(input_string, result)
+        elif stats is not None:
+            stats.inline_memo_hits += 1
+        return result
+
+    @staticmethod
+    def render(input_string, stats=None):
+        inlines = InlineParser.get_inlines(input_string)
+        if stats is not None:
+            stats.add_inlines(inlines)
+        return InlineParser.get_html(inlines)
+
+    @staticmethod
+    def get_html(inlines):
+        """Return the HTML of inlines, nested emphasis is walked with a stack instead of recursion"""
         out = []
-        for part in parts:
-            if type(part) is Text:
-                out.extend(function(part.text))
+        stack = [(iter(inlines), "")]
+        while stack:
+            children, end = stack[-1]
+            for inline in children:
+                if type(inline) is Emphasis and inline.children:
+                    start, inner_end = inline.tags()
+                    out.append(start)
+                    stack.append((iter(inline.children), inner_end))
+                    break
+                out.append(inline.get_html())
             else:
-                part.compute(function, exceptions)
-                out.append(part)
-        return out
-
+                stack.pop()
+                out.append(end)
+        return "".join(out)
 
     @staticmethod
-    def look_for_link_or_img():
-        # TODO: not supported yet
-        pass
+    def get_text(inlines):
+        """Return the plain text of inlines, without escaping"""
+        out = []
+        stack = [iter(inlines)]
+        while stack:
+            for inline in stack[-1]:
+                if type(inline) is Emphasis:
+                    stack.append(iter(inline.children))
+                    break
+                out.append(inline.get_text())
+            else:
+                stack.pop()
+        return "".join(out)
 
     @staticmethod
-    def get_autolinks(text):
-        autolink = re.compile("[\s\S]*?<(?P<link>(?P<scheme>[a-zA-Z][a-zA-Z+-.]+?):[^\s<>]*?)>")
-        pos = 0
+    def get_inlines(text):
+        """Split text into inline elements in a single left-to-right scan"""
         parts = []
+        pos = 0
         while pos < len(text):
-            m = autolink.match(text, pos)
-            if m is not None:
-                r = m.groupdict()
-                if pos != m.start("link") - 1:
-                    # Save text before link
-                    parts.append(Text(text[pos:m.start("link") - 1]))
-                parts.append(Autolink())
-                parts[-1].add(Text(r['link']))
-                pos = m.end()
-            else:
-                parts.append(Text(text[pos:]))
+            start, end, link = InlineParser.get_next_autolink(text, pos)
+            if pos != start:
+                # Text between autolinks, which may start with a code span
+                parts.extend(InlineParser.get_code_span(text, pos, start))
+            if link is None:
                 break
+            parts.append(link)
+            pos = end
         return parts
 
     @staticmethod
-    def get_emailautolinks(text):
-        autolink = re.compile("[\s\S]*?<(?P<address>[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*)>")
-        pos = 0
-        parts = []
-        while pos < len(text):
-            m = autolink.match(text, pos)
+    def look_for_link_or_img():
+        # TODO: not supported yet
+        pass
+
+    @staticmethod
+    def get_next_autolink(text, pos):
+        """Get start, end and element of the next (email) autolink"""
+        start = text.find("<", pos)
+        while start > -1:
+            m = InlineParser.AUTOLINK_REGEX.match(text, start)
             if m is not None:
-                r = m.groupdict()
-                if pos != m.start("address") - 1:
-                    # Save text before link
-                    parts.append(Text(text[pos:m.start("address") - 1]))
-                parts.append(EMailAutolink())
-                parts[-1].add(Text(r['address']))
-                pos = m.end()
-            else:
-                parts.append(Text(text[pos:]))
-                break
-        return parts
+                link = Autolink()
+                link.add(Text(m.group("link")))
+                return start, m.end(), link
+            m = InlineParser.EMAIL_AUTOLINK_REGEX.match(text, start)
+            if m is not None:
+                link = EMailAutolink()
+                link.add(Text(m.group("address")))
+                return start, m.end(), link
+            start = text.find("<", start + 1)
+        return len(text), len(text), None
 
     @staticmethod
-    def get_code_spans(text):
-        """Get code spans"""
-        code = re.compile(r"[\s\S]*?(?=[^`]|\A)(?P<tick>`+)(?!`)(?P<content>[\s\S]*?)(?<=[^`])\1((?!`)|$)")
-        pos = 0
+    def get_code_span(text, start, end):
+        """Get the inlines of text[start:end], only its beginning can be a code span"""
         parts = []
-        while pos < len(text):
-            m = code.match(text, pos)
-            if m is not None:
-                r = m.groupdict()
-                if pos != m.start('tick'):
-                    parts.append(Text(text[pos:m.start('tick')]))
-                parts.append(CodeSpan())
-                parts[-1].add(Text(r['content']))
-                pos = m.end()
-            else:
-                parts.append(Text(text[pos:]))
-                break
+        if text.startswith("`", start, end):
+            opening = InlineParser.BACKTICKS_REGEX.match(text, start, end)
+            # The code span ends with the next backtick string of the same length
+            for closing in InlineParser.BACKTICKS_REGEX.finditer(text, opening.end(), end):
+                if closing.end() - closing.start() == opening.end() - opening.start():
+                    parts.append(CodeSpan())
+                    parts[-1].add(Text(text[opening.end():closing.start()]))
+                    start = closing.end()
+                    break
+        if start < end:
+            for part in InlineParser.get_emphasis(text[start:end]):
+                if type(part) is Text:
+                    parts.extend(InlineParser.get_hard_breaks(part.text))
+                else:
+                    InlineParser.split_hard_breaks(part)
+                    parts.append(part)
         return parts
 
+    @staticmethod
+    def split_hard_breaks(emphasis):
+        """Split the texts in (nested) emphasis at hard line breaks"""
+        stack = [emphasis]
+        while stack:
+            inline = stack.pop()
+            children = []
+            for child in inline.children:
+                if type(child) is Text:
+                    children.extend(InlineParser.get_hard_breaks(child.text))
+                else:
+                    children.append(child)
+                    stack.append(child)
+            inline.children = children
+
     @staticmethod
     def get_hard_breaks(text):
-        hard_break = re.compile(r"[\s\S]*?(?P<break>[ ]{2,}|\t|[\\])\n")
-        pos = 0
+        """Split text at hard line breaks and unescape the text in between"""
         parts = []
-        if pos == len(text):
-            return [Text(text)]
-        while pos < len(text):
-            m = hard_break.match(text, pos)
-            if m is not None:
-                parts.append(Text(text[pos:m.start("break")].rstrip()))
-                parts.append(HardBreak())
-                pos = m.end()
-            else:
-                parts.append(Text(text[pos:]))
-                break
+        pos = 0
+        for m in InlineParser.HARD_BREAK_REGEX.finditer(text):
+            parts.append(Text(InlineParser.unescape(text[pos:m.start("break")].rstrip())))
+            parts.append(HardBreak())
+            pos = m.end()
+        if pos < len(text) or not text:
+            parts.append(Text(InlineParser.unescape(text[pos:])))
         return parts
 
     @staticmethod
     def unescape(text):
-        return [Text(re.sub(r"\\(?P<char>[{}])".format(re.escape(string.punctuation)), r"\g<char>", text))]
+        return InlineParser.ESCAPED_REGEX.sub(r"\g<char>", text)
 
     @staticmethod
     def get_emphasis(text):
         """Get emphasis"""
         delimiter_stack = []
-        delimiter_regex = re.compile(r"[\s\S]*?(?P<pre>[^_*\s\]!\[]?)(?P<deli>[*]+|[_]+|\[|!\[|])(?P<post>\S?)")
         pos = 0
         parts = []
-        while True:
-            m = delimiter_regex.match(text, pos)
-            if m is not None:
-                parts.append(Text(text[pos:m.end("deli")]))
-                r = m.groupdict()
-                if m.group("deli").startswith("*"):
-                    delimiter_stack.append(Delimiter("*", len(m.group("deli")), not r['pre'] and r['post'],
-                                                     r['pre'],
-                                                     len(parts) - 1))
-                elif m.group("deli").startswith("_"):
-                    delimiter_stack.append(Delimiter("_", len(m.group("deli")),
-                                                     (not r['pre'] or r['pre'] in string.punctuation) and r['post'],
-                                                     r['pre'], len(parts) - 1))
-                elif m.group("deli") == "[":
-                    delimiter_stack.append(Delimiter("[", 1, True, True, len(parts) - 1))
-                elif m.group("deli") == "![":
-                    delimiter_stack.append(Delimiter("![", 1, True, True, len(parts) - 1))
-                else:
-                    InlineParser.look_for_link_or_img()
-                pos = m.end("deli")
+        for m in InlineParser.DELIMITER_REGEX.finditer(text):
+            parts.append(Text(text[pos:m.end()]))
+            deli = m.group()
+            # Characters around the delimiter run, the one before can't be another delimiter
+            pre = text[m.start() - 1] if m.start() > pos else ""
+            if pre in InlineParser.NO_PRE_CHARACTERS or pre.isspace():
+                pre = ""
+            post = text[m.end()] if m.end() < len(text) and not text[m.end()].isspace() else ""
+            if deli.startswith("*"):
+                delimiter_stack.append(Delimiter("*", len(deli), not pre and post, pre, len(parts) - 1))
+            elif deli.startswith("_"):
+                delimiter_stack.append(Delimiter("_", len(deli), (not pre or pre in string.punctuation) and post,
+                                                 pre, len(parts) - 1))
+            elif deli == "[":
+                delimiter_stack.append(Delimiter("[", 1, True, True, len(parts) - 1))
+            elif deli == "![":
+                delimiter_stack.append(Delimiter("![", 1, True, True, len(parts) - 1))
             else:
-                parts.append(Text(text[pos:]))
-                break
+                InlineParser.look_for_link_or_img()
+            pos = m.end()
+        parts.append(Text(text[pos:]))
         emphs = InlineParser.process_emphasis(delimiter_stack, None)
-        used = []
+        # Emphasis by the position of its first part, with the position of its closer. Inner emphasis is
+        # found before the emphasis around it, which takes it over as a child, so every part is moved once.
+        groups = {}
+        for opener, closer, size in emphs:
+            parts[opener.position].text = parts[opener.position].text[:-size]
+            emphasis = Emphasis(strong=size > 1)
+            i = opener.position + 1
+            while i < closer.position:
+                group = groups.pop(i, None)
+                if group is None:
+                    emphasis.add(parts[i])
+                    i += 1
+                else:
+                    emphasis.add(group[0])
+                    i = group[1] + 1
+            emphasis.add(Text(parts[closer.position].text[:-size]))
+            groups[opener.position + 1] = (emphasis, closer.position)
         out = []
-        for e in emphs:
-            parts[e[0].position].text = parts[e[0].position].text[:-e[2]]
-            text = ""
-            for i in range(e[0].position + 1, e[1].position):
-                used.append(i)
-                text += parts[i].text
-            text += parts[e[1].position].text[:-e[2]]
-            used.append(e[1].position)
-            out.append((Emphasis(strong=e[2] > 1), e[0].position + 1))
-            out[-1][0].add(Text(text))
-        for i, part in enumerate(parts):
-            if i not in used:
-                out.append((parts[i], i))
-        return [e[0] for e in sorted(out, key=lambda x: x[1])]
+        i = 0
+        while i < len(parts):
+            group = groups.get(i)
+            if group is None:
+                out.append(parts[i])
+                i += 1
+            else:
+                out.append(group[0])
+                i = group[1] + 1
+        return out
 
     @staticmethod
     def process_emphasis(delimiter_stack, stack_bottom):
+        """
+        Match emphasis delimiters, returns (opener, closer, size) in the order they are found.
+        The delimiters are linked in a list that only keeps possible openers, and for each type
+        openers_bottom is the position below which no opener can be found anymore.
+        """
         emphs = []
-        delimiter_stack = delimiter_stack
-        if stack_bottom is None:
-            current_position = 0
-        else:
-            current_position = stack_bottom + 1
-        
-        while current_position < len(delimiter_stack):
-            cur_del = delimiter_stack[current_position]
-            if cur_del.type not in ["*", "_"] or not cur_del.active or not cur_del.potential_closer:
-                current_position += 1
+        first = InlineParser.link_delimiters(delimiter_stack[0 if stack_bottom is None else stack_bottom + 1:])
+        openers_bottom = {"*": -1, "_": -1}
+        cur_del = first
+        while cur_del is not None:
+            next_del = cur_del.next
+            if not cur_del.potential_closer:
+                cur_del = next_del
                 continue
-            i = current_position - 1
-            while i > -1:
-                other = delimiter_stack[i]
-                if other.type != cur_del.type or not other.active or not other.potential_opener:
-                    i -= 1
-                    continue
+            other = cur_del.previous
+            while other is not None and other.position >= openers_bottom[cur_del.type] \
+                    and not (other.type == cur_del.type and other.potential_opener):
+                other = other.previous
+            if other is not None and other.position >= openers_bottom[cur_del.type]:
+                if cur_del.number >= 2 and other.number >= 2:
+                    # start, end, size
+                    emphs.append((other, cur_del, 2))
+                    cur_del.number -= 2
+                    other.number -= 2
                 else:
-                    if cur_del.number >= 2 and other.number >= 2:
-                        # start, end, size
-                        emphs.append((other, cur_del, 2))
-                        cur_del.number -= 2
-                        other.number -= 2
-                    else:
-                        emphs.append((other, cur_del, 1))
-                        cur_del.number -= 1
-                        other.number -= 1
-                    for e in delimiter_stack:
-                        if other.position <= e.position <= cur_del.position:
-                            e.active = False
-                    break
-            current_position += 1
+                    emphs.append((other, cur_del, 1))
+                    cur_del.number -= 1
+                    other.number -= 1
+                # Delimiters between the opener and the closer can't be used anymore
+                while other is not cur_del:
+                    other.remove()
+                    other = other.next
+                cur_del.remove()
+            else:
+                # No opener for this type before this closer, later closers don't need to look further
+                openers_bottom[cur_del.type] = cur_del.position
+                if not cur_del.potential_opener:
+                    cur_del.remove()
+            cur_del = next_del
         return emphs
 
+    @staticmethod
+    def link_delimiters(delimiter_stack):
+        """Link the emphasis delimiters that could be used as opener or closer, returns the first one"""
+        first = None
+        last = None
+        for delimiter in delimiter_stack:
+            if delimiter.type not in ["*", "_"] or not (delimiter.potential_opener or delimiter.potential_closer):
+                continue
+            delimiter.previous = last
+            if last is None:
+                first = delimiter
+            else:
+                last.next = delimiter
+            last = delimiter
+        return first
+
 
 class Delimiter(object):
+    __slots__ = ("type", "number", "potential_opener", "potential_closer", "active", "position", "previous", "next")
+
     def __init__(self, type, number, potential_opener, potential_closer, position):
         self.type = type
         self.number = number
@@ -227,84 +342,114 @@ class Delimiter(object):
         self.potential_closer = potential_closer
         self.active = True
         self.position = position
+        self.previous = None
+        self.next = None
+
+    def remove(self):
+        """Deactivate delimiter and unlink it from the delimiter list"""
+        self.active = False
+        if self.previous is not None:
+            self.previous.next = self.next
+        if self.next is not None:
+            self.next.previous = self.previous
 
 
 class Inline(object):
+    __slots__ = ()
     _TEMPLATE = ""
-
-    def __init__(self):
-        self.children = []
+    _TEXT = ""
+    # Only container inlines have a list of children
+    children = ()
 
     def get_html(self):
         return self._TEMPLATE
 
+    def get_text(self):
+        return self._TEXT
+
+
+class ContainerInline(Inline):
+    """Inline that contains other inlines"""
+    __slots__ = ("children",)
+
+    def __init__(self):
+        self.children = []
+
     def add(self, inline):
         self.children.append(inline)
 
-    def compute(self, function, exceptions):
-        if type(self) in exceptions:
-            return
-        temp = []
-        for child in self.children:
-            if type(child) is Text:
-                temp.extend(function(child.text))
-            else:
-                child.compute(function, exceptions)
-                temp.append(child)
-        self.children = temp
+    def get_text(self):
+        return "".join([c.get_text() for c in self.children])
 
 
 class SoftBreak(Inline):
+    __slots__ = ()
     _TEMPLATE = "\n"
+    _TEXT = "\n"
 
 
 class HardBreak(Inline):
+    __slots__ = ()
     _TEMPLATE = "<br />"
+    _TEXT = "\n"
     def get_html(self):
         return self._TEMPLATE
 
 
-class Emphasis(Inline):
-    _TEMPLATE_EM = "<em>{content}</em>"
-    _TEMPLATE_STRONG = "<strong>{content}</strong>"
+class Emphasis(ContainerInline):
+    __slots__ = ("strong",)
+    _TAGS_EM = ("<em>", "</em>")
+    _TAGS_STRONG = ("<strong>", "</strong>")
 
     def __init__(self, strong=False):
         super().__init__()
         self.strong = strong
 
+    def tags(self):
+        """Return the tags before and after the content"""
+        return self._TAGS_STRONG if self.strong else self._TAGS_EM
+
     def get_html(self):
-        if not self.children:
-            return ""
-        if self.strong:
-            return self._TEMPLATE_STRONG.format(content="".join([c.get_html() for c in self.children]))
-        else:
-            return self._TEMPLATE_EM.format(content="".join([c.get_html() for c in self.children]))
+        return InlineParser.get_html([self])
+
+    def get_text(self):
+        return InlineParser.get_text([self])
 
 
 class Text(Inline):
+    __slots__ = ("text",)
+
     def __init__(self, text=""):
-        super().__init__()
         self.text = text
 
     def get_html(self):
         return html.escape(self.text)
 
+    def get_text(self):
+        return self.text
 
-class CodeSpan(Inline):
+
+class CodeSpan(ContainerInline):
+    __slots__ = ()
     _TEMPLATE = "<code>{content}</code>"
 
     def get_html(self):
         return self._TEMPLATE.format(content=html.escape("".join([c.get_html() for c in self.children])).strip())
 
+    def get_text(self):
+        return "".join([c.get_text() for c in self.children]).strip()
+
 
-class Autolink(Inline):
+class Autolink(ContainerInline):
+    __slots__ = ()
     _TEMPLATE = "<a href=\"{link}\">{text}</a>"
     def get_html(self):
         text = self.children[0].get_html()
         return self._TEMPLATE.format(link=text, text=text)
 
 
-class EMailAutolink(Inline):
+class EMailAutolink(ContainerInline):
+    __slots__ = ()
     _TEMPLATE = "<a href=\"mailto:{link}\">{text}</a>"
 
     def get_html(self):
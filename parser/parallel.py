@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .gfm import GFMParser
+import multiprocessing
+import re
+
+
+def chunk_lines(text, last):
+    """
+    Return the lines of a chunk like parse_text splits them, the empty line after a trailing newline only
+    belongs to the last chunk
+    """
+    lines = list(GFMParser.text_lines(text))
+    if not last:
+        lines.pop()
+    return lines
+
+
+def new_parser(line_number, lazy, last_strip):
+    """Return a parser that continues at line_number with the given lazy and last_strip values"""
+    parser = GFMParser()
+    parser.line_number = line_number
+    parser.lazy = lazy
+    parser.last_strip = last_strip
+    return parser
+
+
+def parse_chunk(task):
+    """
+    Parse and render a chunk with a new parser, which starts at line_number with lazy. Then parse next_line,
+    the first line of the next chunk. Return the HTML, the lazy and last_strip values after the first line
+    (None if it didn't start a single top-level block) and (lazy and last_strip before next_line, the values
+    after it, whether it started a single new top-level block), None for the last chunk.
+    """
+    text, line_number, lazy, next_line = task
+    parser = new_parser(line_number, lazy, 0)
+    children = parser.document.children
+    lines = chunk_lines(text, next_line is None)
+    parser.parse_line(lines[0])
+    first = (parser.lazy, parser.last_strip) if len(children) == 1 else None
+    for line in lines[1:]:
+        parser.parse_line(line)
+    if next_line is None:
+        return parser.get_html(), first, None
+    before = (parser.lazy, parser.last_strip)
+    count = len(children)
+    parser.parse_line(next_line)
+    end = (before, (parser.lazy, parser.last_strip), len(children) == count + 1)
+    # The blocks before next_line can't change anymore if it started a new one
+    return parser.document.pop_html(count), first, end
+
+
+class ParallelParser(object):
+    """
+    Converts a single large document in a pool of worker processes. The text is split into chunks at blank
+    lines followed by a line at column 0 that doesn't continue a list, block quote or fenced code block, and
+    each chunk is parsed and rendered by a new parser.
+
+    A chunk parsed by a worker is used if the serial parse would start a new top-level block with its first
+    line and have the same lazy and last_strip values after it. Everything else the parser state holds
+    belongs to that new block then, which both parsers build the same way. Otherwise this process parses on
+    serially until the state matches a worker again, so the HTML is always the same as that of GFMParser.
+    """
+    # Characters of a chunk
+    CHUNK_SIZE = 1 << 20
+    # Lines that may continue a list or block quote after a blank line
+    CONTINUATION_REGEX = re.compile(r"[ \t\n]|>|[\-+*]([ \t\n]|$)|\d{1,9}[.)]([ \t\n]|$)")
+    # Lines in a list or block quote, after them lines at column 0 are parsed as lazy
+    CONTAINER_REGEX = re.compile(r" {0,3}(>|[\-+*]([ \t\n]|$)|\d{1,9}[.)]([ \t\n]|$))")
+    FENCE_REGEX = re.compile(r" {0,3}(`{3,}|~{3,})")
+
+    def __init__(self, workers=None, chunk_size=CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # Chunks of the last document and the ones of them that were parsed in this process
+        self.chunks = 0
+        self.serial_chunks = 0
+
+    def split_points(self, text):
+        """Return the offset, line number and the expected lazy value of the chunks after the first"""
+        points = []
+        blank = False
+        fence = None
+        lazy = False
+        chunk_start = 0
+        pos = 0
+        line_number = 0
+        length = len(text)
+        while pos < length:
+            end = text.find("\n", pos) + 1 or length
+            m = self.FENCE_REGEX.match(text, pos, end)
+            if fence is not None:
+                if m is not None and m.group(1).startswith(fence) and not text[m.end():end].strip():
+                    fence = None
+            elif m is not None:
+                fence = m.group(1)
+            elif blank and pos - chunk_start >= self.chunk_size and \
+                    self.CONTINUATION_REGEX.match(text, pos, end) is None:
+                points.append((pos, line_number, lazy))
+                chunk_start = pos
+            lazy = lazy or self.CONTAINER_REGEX.match(text, pos, end) is not None
+            blank = not text[pos:end].strip()
+            pos = end
+            line_number += 1
+        return points
+
+    def get_html(self, text):
+        points = self.split_points(text)
+        self.chunks = len(points) + 1
+        self.serial_chunks = 0
+        if not points:
+            self.serial_chunks = 1
+            return GFMParser().parse_text(text).get_html()
+        starts = [(0, 0, False)] + points
+        chunks = []
+        for i, (start, line_number, lazy) in enumerate(starts):
+            if i + 1 < len(starts):
+                end = starts[i + 1][0]
+                next_line = text[end:text.find("\n", end) + 1 or len(text)]
+                chunks.append((text[start:end], line_number, lazy, next_line))
+            else:
+                chunks.append((text[start:], line_number, lazy, None))
+        with multiprocessing.Pool(self.workers) as pool:
+            results = pool.map(parse_chunk, chunks, 1)
+
+        html = []
+        # Parser of this process, it continues the serial parse before the first line of chunk i
+        # (or after it if first_parsed)
+        parser = None
+        first_parsed = False
+        for i, (chunk_html, first, end) in enumerate(results):
+            chunk, line_number, lazy, next_line = chunks[i]
+            if parser is None:
+                # The worker parsed this chunk like the serial parse
+                if end is None:
+                    html.append(chunk_html)
+                    break
+                before, after, new_block = end
+                if new_block:
+                    html.append(chunk_html)
+                    if after != results[i + 1][1]:
+                        # The next chunk continues with other values than its worker assumed
+                        parser = new_parser(chunks[i + 1][1], *before)
+                        first_parsed = False
+                    continue
+                # The next chunk continues a block of this one, parse both here
+                parser = new_parser(line_number, lazy, 0)
+                first_parsed = False
+            self.serial_chunks += 1
+            for line in chunk_lines(chunk, next_line is None)[1 if first_parsed else 0:]:
+                parser.parse_line(line)
+            if next_line is None:
+                html.append(parser.get_html())
+                break
+            count = len(parser.document.children)
+            parser.parse_line(next_line)
+            first_parsed = True
+            if len(parser.document.children) == count + 1:
+                html.append(parser.document.pop_html(count))
+                if (parser.lazy, parser.last_strip) == results[i + 1][1]:
+                    # Back in step with the workers
+                    parser = None
+        return "".join(html)
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .gfm import GFMParser
+import multiprocessing
+import threading
+import time
+
+
+class RenderTimeout(Exception):
+    """Rendering took longer than its budget and was cancelled"""
+
+
+class PoolBusy(Exception):
+    """Too many documents are waiting for a worker"""
+
+
+class RenderError(Exception):
+    """The parser raised an exception in the worker"""
+
+
+def work(connection):
+    """Main function of a worker process: render the received texts until the connection is closed"""
+    while True:
+        try:
+            text = connection.recv()
+        except EOFError:
+            return
+        try:
+            parser = GFMParser(stats=True).parse_text(text)
+            connection.send((True, (parser.get_html(), parser.stats.as_dict())))
+        except Exception as e:
+            connection.send((False, "{}: {}".format(type(e).__name__, e)))
+
+
+class Worker(object):
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=work, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.connection.close()
+        self.process.join()
+
+
+class RenderPool(object):
+    """
+    Render documents in a bounded number of worker processes. A render that exceeds its
+    timeout is cancelled by terminating its worker, which is replaced by a new one.
+    At most max_queue documents wait for a free worker, further ones are rejected.
+    hook is called with the ParserStats.as_dict() of every rendered document.
+    """
+    def __init__(self, workers, max_queue, hook=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.hook = hook
+        # Workers are started with spawn, forking a threaded server isn't safe
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = [Worker(self.context) for _ in range(workers)]
+        self.slots = threading.Semaphore(workers)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def render(self, text, timeout):
+        """Return the HTML of text, raise PoolBusy, RenderTimeout or RenderError"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            if self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PoolBusy()
+            self.pending += 1
+        try:
+            if not self.slots.acquire(timeout=timeout):
+                with self.lock:
+                    self.timeouts += 1
+                raise RenderTimeout()
+            try:
+                return self.run(text, deadline)
+            finally:
+                self.slots.release()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def run(self, text, deadline):
+        """Render text in an idle worker, a slot has to be held"""
+        with self.lock:
+            worker = self.idle.pop() if self.idle else None
+        if worker is None or not worker.process.is_alive():
+            worker = Worker(self.context)
+        try:
+            worker.connection.send(text)
+            if not worker.connection.poll(max(deadline - time.monotonic(), 0)):
+                worker.kill()
+                with self.lock:
+                    self.timeouts += 1
+                raise RenderTimeout()
+            success, result = worker.connection.recv()
+        except (OSError, EOFError) as e:
+            # The worker died
+            worker.kill()
+            raise RenderError("{}: {}".format(type(e).__name__, e))
+        with self.lock:
+            self.idle.append(worker)
+        if not success:
+            raise RenderError(result)
+        html, stats = result
+        if self.hook is not None:
+            self.hook(stats)
+        return html
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            worker.kill()
+
+    def stats(self):
+        with self.lock:
+            return {"workers": self.workers, "pending": self.pending, "max_queue": self.max_queue,
+                    "timeouts": self.timeouts, "rejected": self.rejected}
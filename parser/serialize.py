@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from . import blocks
+from . import inlines
+from .gfm import GFMParser
+import functools
+import hashlib
+import marshal
+import os
+import zlib
+
+# Changed whenever the layout of a dumped tree changes
+FORMAT_VERSION = 1
+# Slots that aren't stored: they are restored from the tree or only needed while parsing
+NOT_STORED = {"children", "spine", "line_index", "list", "inlines", "end_regex", "depth", "closed", "close_next"}
+
+
+@functools.lru_cache(None)
+def stored_slots(node_type):
+    """Return the names of the attributes of a block or inline type that are dumped"""
+    names = []
+    for base in reversed(node_type.__mro__):
+        names.extend(name for name in base.__dict__.get("__slots__", ()) if name not in NOT_STORED)
+    if not issubclass(node_type, blocks.LeafBlock) and "lines" in names:
+        # Only leaf blocks have lines
+        names.remove("lines")
+    return tuple(names)
+
+
+def node_types(module, base):
+    """Return the subclasses of base in module, their index in the list is their code in a dumped tree"""
+    return [value for name, value in sorted(vars(module).items())
+            if isinstance(value, type) and issubclass(value, base) and value.__module__ == module.__name__]
+
+
+BLOCK_TYPES = node_types(blocks, blocks.Block)
+INLINE_TYPES = node_types(inlines, inlines.Inline)
+BLOCK_CODES = {node_type: code for code, node_type in enumerate(BLOCK_TYPES)}
+INLINE_CODES = {node_type: code for code, node_type in enumerate(INLINE_TYPES)}
+
+
+def dump(document):
+    """
+    Return the tree of a parsed document as bytes. The nodes are stored as a flat tuple in document
+    order: the code of the type, the stored attributes, then the number of children for containers.
+    A leaf block is followed by its inline tree, or -1 if it doesn't render one.
+    The inline trees are computed here and kept on the blocks, the document renders from them.
+    """
+    nodes = []
+    # (block, loose value like in Block.write_html)
+    stack = [(document, None)]
+    while stack:
+        block, loose = stack.pop()
+        node_type = type(block)
+        nodes.append(BLOCK_CODES[node_type])
+        nodes.extend(getattr(block, name) for name in stored_slots(node_type))
+        if isinstance(block, blocks.ContainerBlock):
+            nodes.append(len(block.children))
+            loose = block.html_frame(loose)[3]
+            stack.extend((child, loose) for child in reversed(block.children))
+            continue
+        inline_list = None if loose is False and node_type is blocks.Paragraph else block.get_inlines()
+        if inline_list is None:
+            # No inline content or a tight list paragraph, which is written as it is
+            nodes.append(-1)
+            continue
+        dump_inlines(inline_list, nodes)
+    header = (FORMAT_VERSION,
+              tuple((t.__name__, stored_slots(t)) for t in BLOCK_TYPES),
+              tuple((t.__name__, stored_slots(t)) for t in INLINE_TYPES))
+    return marshal.dumps((header, tuple(nodes)))
+
+
+def dump_inlines(inline_list, nodes):
+    """Append the number of inlines and the inline trees to nodes"""
+    nodes.append(len(inline_list))
+    stack = list(reversed(inline_list))
+    while stack:
+        inline = stack.pop()
+        node_type = type(inline)
+        nodes.append(INLINE_CODES[node_type])
+        nodes.extend(getattr(inline, name) for name in stored_slots(node_type))
+        if isinstance(inline, inlines.ContainerInline):
+            nodes.append(len(inline.children))
+            stack.extend(reversed(inline.children))
+
+
+def load(data):
+    """
+    Return the Document of a dumped tree. It renders like the dumped one without parsing again,
+    but can't be continued with more lines. Raises ValueError for data of another format or parser.
+    """
+    try:
+        header, nodes = marshal.loads(data)
+        version, block_types, inline_types = header
+    except (EOFError, ValueError, TypeError):
+        raise ValueError("not a dumped document tree")
+    if version != FORMAT_VERSION or \
+            block_types != tuple((t.__name__, stored_slots(t)) for t in BLOCK_TYPES) or \
+            inline_types != tuple((t.__name__, stored_slots(t)) for t in INLINE_TYPES):
+        raise ValueError("document tree was dumped by another parser version")
+    try:
+        document = load_blocks(nodes)
+    except (IndexError, KeyError, TypeError, AttributeError) as e:
+        # Corrupt data, e.g. a wrong type code or a truncated node list
+        raise ValueError("corrupt document tree: {}: {}".format(type(e).__name__, e))
+    document.spine = [document]
+    document.line_index = []
+    return document
+
+
+def load_blocks(nodes):
+    """Return the Document of the node list of a dumped tree"""
+    block_slots = [stored_slots(t) for t in BLOCK_TYPES]
+    document = None
+    # Open containers as [container, number of children still to load]
+    stack = []
+    i = 0
+    while i < len(nodes):
+        code = nodes[i]
+        node_type = BLOCK_TYPES[code]
+        block = node_type.__new__(node_type)
+        block.closed = True
+        block.close_next = False
+        block.end_regex = None
+        block.depth = 0
+        for name in block_slots[code]:
+            i += 1
+            setattr(block, name, nodes[i])
+        i += 1
+        if stack:
+            parent = stack[-1]
+            parent[0].children.append(block)
+            parent[1] -= 1
+            if parent[1] == 0:
+                stack.pop()
+            if node_type is blocks.ListItem:
+                block.list = parent[0]
+        else:
+            document = block
+        if isinstance(block, blocks.ContainerBlock):
+            block.lines = []
+            block.children = []
+            if nodes[i]:
+                stack.append([block, nodes[i]])
+            i += 1
+        else:
+            block.inlines, i = load_inlines(nodes, i)
+    if type(document) is not blocks.Document or stack:
+        raise ValueError("incomplete document tree")
+    return document
+
+
+def load_inlines(nodes, i):
+    """Return the inline list stored at position i of nodes (None for -1) and the position after it"""
+    count = nodes[i]
+    i += 1
+    if count < 0:
+        return None, i
+    result = []
+    # Open container inlines as [children, number of children still to load]
+    stack = [[result, count]] if count else []
+    while stack:
+        code = nodes[i]
+        node_type = INLINE_TYPES[code]
+        inline = node_type.__new__(node_type)
+        for name in stored_slots(node_type):
+            i += 1
+            setattr(inline, name, nodes[i])
+        i += 1
+        parent = stack[-1]
+        parent[0].append(inline)
+        parent[1] -= 1
+        if parent[1] == 0:
+            stack.pop()
+        if isinstance(inline, inlines.ContainerInline):
+            inline.children = []
+            if nodes[i]:
+                stack.append([inline.children, nodes[i]])
+            i += 1
+    return result, i
+
+
+@functools.lru_cache(None)
+def parser_version():
+    """Return a hash of the format version and the parser sources, trees are only loaded by the same parser"""
+    digest = hashlib.sha256(str(FORMAT_VERSION).encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in ("blocks.py", "inlines.py", "gfm.py", "serialize.py"):
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ParseCache(object):
+    """
+    Dumped trees of parsed documents in a directory, by hash of the text and the parser version.
+    The files are compressed, they take about half the size of the Markdown.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, text):
+        key = hashlib.sha256(parser_version().encode() + text.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".tree")
+
+    def get(self, text):
+        """Return the Document of text if it is cached, else None"""
+        try:
+            with open(self.path(text), "rb") as f:
+                return load(zlib.decompress(f.read()))
+        except (OSError, ValueError, zlib.error):
+            return None
+
+    def put(self, text, document):
+        path = self.path(text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so concurrent readers never see a partial tree
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "wb") as f:
+            f.write(zlib.compress(dump(document), 1))
+        os.replace(temporary, path)
+
+    def parse(self, text):
+        """Return the Document of text, loaded from the cache or parsed and stored"""
+        document = self.get(text)
+        if document is not None:
+            self.hits += 1
+            return document
+        self.misses += 1
+        document = GFMParser().parse_text(text).document
+        self.put(text, document)
+        return document
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+"""
+Markdown to HTML converter
+Copyright (C) 2017 Valentin Pratz <git@valentinpratz.de>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import threading
+
+
+class ParserStats(object):
+    """Time and counts of a GFMParser, enabled with GFMParser(stats=True)"""
+    def __init__(self):
+        # Seconds in parse_line, in InlineParser.parse and rendering without inline parsing
+        self.block_seconds = 0.0
+        self.inline_seconds = 0.0
+        self.render_seconds = 0.0
+        self.lines = 0
+        # Number of blocks and inlines by class name
+        self.blocks = {}
+        self.inlines = {}
+        # Deepest block, top-level blocks have depth 1
+        self.max_depth = 0
+        # Texts given to the inline parser, and how many of them the memo answered (without inlines)
+        self.inline_texts = 0
+        self.inline_memo_hits = 0
+
+    def add_block(self, block):
+        name = type(block).__name__
+        self.blocks[name] = self.blocks.get(name, 0) + 1
+        self.max_depth = max(self.max_depth, block.depth)
+
+    def add_inlines(self, inlines):
+        """Count inlines and their descendants"""
+        stack = list(inlines)
+        while stack:
+            inline = stack.pop()
+            name = type(inline).__name__
+            self.inlines[name] = self.inlines.get(name, 0) + 1
+            stack.extend(inline.children)
+
+    def as_dict(self):
+        return {"block_seconds": self.block_seconds, "inline_seconds": self.inline_seconds,
+                "render_seconds": self.render_seconds, "lines": self.lines, "blocks": dict(self.blocks),
+                "inlines": dict(self.inlines), "max_depth": self.max_depth, "inline_texts": self.inline_texts,
+                "inline_memo_hits": self.inline_memo_hits}
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed bucket upper bounds, like Prometheus ones"""
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def prometheus(self, name, labels=""):
+        """Return the sample lines of the histogram"""
+        separator = "," if labels else ""
+        lines = []
+        count = 0
+        for bound, bucket_count in zip(self.buckets + ["+Inf"], self.counts):
+            count += bucket_count
+            lines.append('{}_bucket{{{}{}le="{}"}} {}'.format(name, labels, separator, bound, count))
+        labels = "{" + labels + "}" if labels else ""
+        lines.append("{}_sum{} {}".format(name, labels, self.sum))
+        lines.append("{}_count{} {}".format(name, labels, count))
+        return lines
+
+
+class Metrics(object):
+    """Thread-safe aggregate of the ParserStats of many documents in Prometheus text format"""
+    SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+    LINES_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+    DEPTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100)
+    PHASES = ("block", "inline", "render")
+
+    def __init__(self, prefix="markdown"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.seconds = {phase: Histogram(self.SECONDS_BUCKETS) for phase in self.PHASES}
+        self.lines = Histogram(self.LINES_BUCKETS)
+        self.depth = Histogram(self.DEPTH_BUCKETS)
+        self.blocks = {}
+        self.inlines = {}
+        self.inline_texts = 0
+        self.inline_memo_hits = 0
+
+    def add(self, stats):
+        """Add the stats of a document, a ParserStats or its as_dict()"""
+        if isinstance(stats, ParserStats):
+            stats = stats.as_dict()
+        with self.lock:
+            self.documents += 1
+            for phase in self.PHASES:
+                self.seconds[phase].observe(stats[phase + "_seconds"])
+            self.lines.observe(stats["lines"])
+            self.depth.observe(stats["max_depth"])
+            for counts, added in ((self.blocks, stats["blocks"]), (self.inlines, stats["inlines"])):
+                for name, count in added.items():
+                    counts[name] = counts.get(name, 0) + count
+            self.inline_texts += stats["inline_texts"]
+            self.inline_memo_hits += stats["inline_memo_hits"]
+
+    def prometheus(self, extra=()):
+        """
+        Return the metrics in Prometheus text format. extra are further (name, type, help, value)
+        metrics, e.g. cache counters.
+        """
+        name = self.prefix
+        with self.lock:
+            lines = ["# HELP {}_documents_total Converted documents".format(name),
+                     "# TYPE {}_documents_total counter".format(name),
+                     "{}_documents_total {}".format(name, self.documents),
+                     "# HELP {}_phase_seconds Seconds per document in the block, inline and render phase".format(name),
+                     "# TYPE {}_phase_seconds histogram".format(name)]
+            for phase in self.PHASES:
+                lines.extend(self.seconds[phase].prometheus(name + "_phase_seconds", 'phase="{}"'.format(phase)))
+            lines.extend(["# HELP {}_lines Lines per document".format(name),
+                          "# TYPE {}_lines histogram".format(name)])
+            lines.extend(self.lines.prometheus(name + "_lines"))
+            lines.extend(["# HELP {}_depth Deepest block nesting per document".format(name),
+                          "# TYPE {}_depth histogram".format(name)])
+            lines.extend(self.depth.prometheus(name + "_depth"))
+            for kind, counts in (("blocks", self.blocks), ("inlines", self.inlines)):
+                lines.extend(["# HELP {}_{}_total Parsed {} by type".format(name, kind, kind),
+                              "# TYPE {}_{}_total counter".format(name, kind)])
+                lines.extend('{}_{}_total{{type="{}"}} {}'.format(name, kind, t, c) for t, c in sorted(counts.items()))
+            extra = [("inline_texts_total", "counter", "Texts given to the inline parser", self.inline_texts),
+                     ("inline_texts_memoized_total", "counter", "Texts answered by the inline memo",
+                      self.inline_memo_hits)] + list(extra)
+        for metric, metric_type, description, value in extra:
+            lines.extend(["# HELP {}_{} {}".format(name, metric, description),
+                          "# TYPE {}_{} {}".format(name, metric, metric_type),
+                          "{}_{} {}".format(name, metric, value)])
+        return "\n".join(lines) + "\n"
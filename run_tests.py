@@ -20,8 +20,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from parser.gfm import GFMParser
 import sys
 
-# Read file from standard input and print result
-parser = GFMParser()
-for line in sys.stdin:
-    parser.parse_line(line)
-print(parser.get_html())
+# Read file from standard input and print result while parsing
+GFMParser().write_html(sys.stdin, sys.stdout)
+print()
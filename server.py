@@ -18,10 +18,62 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request, abort, jsonify
 from parser.gfm import GFMParser
+from parser.incremental import IncrementalDocument
+from parser.cache import LRUCache
+from parser.inlines import InlineParser
+from parser.pool import RenderPool, RenderTimeout, PoolBusy, RenderError
+from parser.stats import Metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import hashlib
+import json
+import threading
 
 app = Flask(__name__)
+# Larger request bodies are rejected with 413
+MAX_BODY_BYTES = 16 * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
+
+# Rendered HTML by hash of the Markdown input, bounded by the total bytes of HTML
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_TTL = 3600
+render_cache = LRUCache(RENDER_CACHE_BYTES, RENDER_CACHE_TTL)
+
+# Documents of the live preview by session id, the least recently used ones are dropped. Bounded by the
+# characters of their texts, a session document takes about 7 bytes per character.
+SESSION_CHARACTERS = 8 * 1024 * 1024
+sessions = LRUCache(SESSION_CHARACTERS, size=lambda session: len(session.document.text))
+
+# Worker processes for /to-html and /to-html/batch, None renders in the request handler. With workers, larger
+# live preview sessions are rejected, the website converts them with /to-html then.
+# Smaller documents are always rendered in-process, they aren't worth the IPC. They have no time budget, so
+# the limit is kept small: the worst input families of benchmarks/complexity.py take about 20 ms at 1 KiB.
+render_pool = None
+RENDER_TIMEOUT = 10
+SMALL_DOCUMENT = 1024
+# Documents of a batch that are rendered concurrently
+BATCH_THREADS = 8
+
+# Parser statistics of all rendered documents, served at /metrics
+metrics = Metrics()
+
+
+class Session(object):
+    def __init__(self, text):
+        self.document = IncrementalDocument(text)
+        self.lock = threading.Lock()
+
+
+def max_session_text():
+    """
+    Return the maximum characters of a session text. Sessions are parsed in the server process without a
+    time budget, so with workers they are only kept for small documents, like in render.
+    """
+    if render_pool is None:
+        return sessions.max_size
+    return min(SMALL_DOCUMENT, sessions.max_size)
 
 
 @app.route("/")
@@ -29,13 +81,215 @@ def index():
     return render_template("index.html")
 
 
+def render(data):
+    if render_pool is None or len(data) <= SMALL_DOCUMENT:
+        return GFMParser(stats=True, hook=metrics.add).parse_text(data).get_html().encode()
+    return render_pool.render(data, RENDER_TIMEOUT).encode()
+
+
+def render_cached(data):
+    key = hashlib.sha256(data.encode()).hexdigest()
+    return render_cache.get_or_compute(key, render, data)
+
+
+def render_error(e):
+    """Return the HTTP status and the message of an exception raised by render_cached"""
+    if isinstance(e, RenderTimeout):
+        return 503, "timeout"
+    if isinstance(e, PoolBusy):
+        return 503, "busy"
+    if isinstance(e, RenderError):
+        return 500, str(e)
+    return 500, "{}: {}".format(type(e).__name__, e)
+
+
 @app.route("/to-html", methods=["POST"])
 def get_html():
-    """Return converted MD"""
-    data = request.get_data(as_text=True)
-    result = GFMParser().parse_text(data).get_html()
-    return result
+    """Return converted MD, or the error message with 503 (time budget, full queue) or 500"""
+    try:
+        return render_cached(request.get_data(as_text=True))
+    except Exception as e:
+        status, message = render_error(e)
+        return Response(message + "\n", status=status, mimetype="text/plain")
+
+
+def get_batch_items(body):
+    """
+    Return (id, text, error) of the documents in a JSON array or NDJSON body. A document is a
+    string or an object with "text" and an optional "id", the id defaults to the index.
+    """
+    if body.lstrip().startswith("["):
+        try:
+            documents = json.loads(body)
+        except ValueError:
+            abort(400)
+        if type(documents) is not list:
+            abort(400)
+    else:
+        documents = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                documents.append(json.loads(line))
+            except ValueError as e:
+                documents.append(e)
+    items = []
+    for i, document in enumerate(documents):
+        item_id = document.get("id", i) if type(document) is dict else i
+        text = document.get("text") if type(document) is dict else document
+        if isinstance(document, ValueError):
+            items.append((item_id, None, "invalid JSON: {}".format(document)))
+        elif type(text) is not str:
+            items.append((item_id, None, "document must be a string or an object with a text"))
+        else:
+            items.append((item_id, text, None))
+    return items
+
+
+def render_item(text):
+    """Return the HTML of text or an error message"""
+    try:
+        return render_cached(text).decode(), None
+    except Exception as e:
+        return None, render_error(e)[1]
+
+
+@app.route("/to-html/batch", methods=["POST"])
+def get_html_batch():
+    """
+    Convert the documents of a JSON array or NDJSON body concurrently. Return an NDJSON line with the
+    id and the html or an error for every document, in the order they are finished.
+    """
+    items = get_batch_items(request.get_data(as_text=True))
+
+    def results():
+        with ThreadPoolExecutor(BATCH_THREADS) as executor:
+            futures = {}
+            for item_id, text, error in items:
+                if error is not None:
+                    yield json.dumps({"id": item_id, "error": error}) + "\n"
+                else:
+                    futures[executor.submit(render_item, text)] = item_id
+            for future in as_completed(futures):
+                html, error = future.result()
+                result = {"id": futures[future], "html": html} if error is None else \
+                    {"id": futures[future], "error": error}
+                yield json.dumps(result) + "\n"
+
+    return Response(results(), mimetype="application/x-ndjson")
+
+
+@app.route("/cache-stats")
+def cache_stats():
+    """Return hit, miss and eviction counters of the render cache, the sessions and the inline memo"""
+    stats = render_cache.stats()
+    stats["sessions"] = sessions.stats()
+    if InlineParser.memo is not None:
+        stats["inline_memo"] = InlineParser.memo.stats()
+    if render_pool is not None:
+        stats["render_pool"] = render_pool.stats()
+    return jsonify(stats)
+
+
+@app.route("/metrics")
+def get_metrics():
+    """Return the parser statistics and the cache and pool counters in Prometheus text format"""
+    extra = []
+    caches = [("render_cache", render_cache), ("sessions", sessions)]
+    if InlineParser.memo is not None:
+        caches.append(("inline_memo", InlineParser.memo))
+    for name, cache in caches:
+        stats = cache.stats()
+        for counter in ("hits", "misses", "evictions", "expirations"):
+            extra.append(("{}_{}_total".format(name, counter), "counter",
+                          "{} {}".format(name.replace("_", " ").capitalize(), counter), stats[counter]))
+        extra.append(("{}_entries".format(name), "gauge", "Entries in the " + name.replace("_", " "),
+                      stats["entries"]))
+        extra.append(("{}_size".format(name), "gauge", "Total size of the entries in the " + name.replace("_", " "),
+                      stats["size"]))
+    if render_pool is not None:
+        stats = render_pool.stats()
+        extra.append(("render_pool_pending", "gauge", "Documents being rendered or waiting", stats["pending"]))
+        extra.append(("render_pool_timeouts_total", "counter", "Renders cancelled by the time budget",
+                      stats["timeouts"]))
+        extra.append(("render_pool_rejected_total", "counter", "Documents rejected by a full queue",
+                      stats["rejected"]))
+    return Response(metrics.prometheus(extra), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/session/<session_id>", methods=["PUT"])
+def set_session_text(session_id):
+    """Start a live preview session (or replace its text), return converted MD"""
+    text = request.get_data(as_text=True)
+    if len(text) > max_session_text():
+        # The client converts it with /to-html instead
+        abort(413)
+    session = Session(text)
+    sessions.put(session_id, session)
+    return session.document.get_html()
+
+
+@app.route("/session/<session_id>/edit", methods=["POST"])
+def edit_session(session_id):
+    """
+    Apply an edit to the text of a session and return converted MD.
+    The edit is a JSON object with the offset and number of deleted characters and the inserted text.
+    """
+    session = sessions.get(session_id)
+    if session is None:
+        # Unknown or dropped session, the client has to send the full text again
+        abort(404)
+    edit = request.get_json(force=True, silent=True) or {}
+    offset, deleted, text = edit.get("offset"), edit.get("deleted"), edit.get("text")
+    if type(offset) is not int or type(deleted) is not int or type(text) is not str:
+        abort(400)
+    with session.lock:
+        if len(session.document.text) - deleted + len(text) > max_session_text():
+            abort(413)
+        try:
+            session.document.edit(offset, deleted, text)
+        except ValueError:
+            abort(400)
+        # Store it again with the size of the new text
+        sessions.put(session_id, session)
+        return session.document.get_html()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8082)
\ No newline at end of file
+    argp = argparse.ArgumentParser(description="Markdown to HTML server")
+    argp.add_argument('--cache-bytes', type=int, default=RENDER_CACHE_BYTES,
+                      help="Maximum bytes of cached HTML, 0 disables the render cache")
+    argp.add_argument('--cache-ttl', type=float, default=RENDER_CACHE_TTL,
+                      help="Seconds until cached HTML expires, 0 for no expiry")
+    argp.add_argument('--session-characters', type=int, default=SESSION_CHARACTERS,
+                      help="Maximum characters of the texts of all live preview sessions, the least recently "
+                           "used sessions are dropped")
+    argp.add_argument('--inline-memo', type=int, default=InlineParser.MEMO_SIZE,
+                      help="Maximum characters of memoized inline texts and HTML, 0 disables the memo")
+    argp.add_argument('--workers', type=int, default=0,
+                      help="Render /to-html in this many worker processes, 0 renders in the server process")
+    argp.add_argument('--queue', type=int, default=32,
+                      help="Maximum documents waiting for a worker, further requests get 503")
+    argp.add_argument('--timeout', type=float, default=RENDER_TIMEOUT,
+                      help="Seconds a document may take in a worker before it gets 503")
+    argp.add_argument('--small', type=int, default=SMALL_DOCUMENT,
+                      help="Render documents and keep live preview sessions up to this many characters in the "
+                           "server process, without a time budget (0 sends all documents to the workers)")
+    argp.add_argument('--max-body', type=int, default=MAX_BODY_BYTES,
+                      help="Maximum bytes of a request body, larger ones get 413")
+    argp.add_argument('--batch-threads', type=int, default=BATCH_THREADS,
+                      help="Documents of a /to-html/batch request that are rendered concurrently")
+    args = argp.parse_args()
+    render_cache = LRUCache(args.cache_bytes, args.cache_ttl or None)
+    sessions = LRUCache(args.session_characters, size=sessions.size)
+    if args.inline_memo:
+        InlineParser.enable_memo(args.inline_memo)
+    app.config["MAX_CONTENT_LENGTH"] = args.max_body
+    RENDER_TIMEOUT = args.timeout
+    SMALL_DOCUMENT = args.small
+    BATCH_THREADS = args.batch_threads
+    if args.workers:
+        render_pool = RenderPool(args.workers, args.queue, hook=metrics.add)
+
+    app.run(host="0.0.0.0", port=8082, threaded=True)
\ No newline at end of file